@@ -0,0 +1,151 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import cv2 as cv
+from Camera import openFrameSource
+from Vision import VisionPipeline
+
+#################################################
+# Vision benchmark
+#
+# Replays recorded clips (see Camera.py, python Main.py --record clip.avi)
+# through each stage of the vision pipeline, reports per-stage latency and
+# frames per second, and optionally fails if a stage got slower than a
+# stored baseline.
+#
+#   python Benchmark.py clip.avi --out results.json
+#   python Benchmark.py clip.avi --baseline results.json --threshold 0.2
+#################################################
+
+stageNames = [ 'flip', 'hsv', 'inRange', 'close', 'bitwiseAnd', 'gray',
+               'findContours', 'detectMultiScale', 'pipeline' ]
+
+def timeStages(frame, pipeline, timings):
+    # the individual steps, with the same parameters the pipeline uses
+    l_h, u_h, l_s, u_s, l_v, u_v = pipeline.hsvBounds
+    l_c = np.array([l_h, l_s, l_v])
+    u_c = np.array([u_h, u_s, u_v])
+
+    start = time.perf_counter()
+    flipped = cv.flip(frame, 1)
+    end = time.perf_counter(); timings['flip'].append(end - start); start = end
+    hsv = cv.cvtColor(flipped, cv.COLOR_BGR2HSV)
+    end = time.perf_counter(); timings['hsv'].append(end - start); start = end
+    mask = cv.inRange(hsv, l_c, u_c)
+    end = time.perf_counter(); timings['inRange'].append(end - start); start = end
+    tracker = cv.morphologyEx(mask, cv.MORPH_CLOSE, pipeline.kernal, iterations=3)
+    end = time.perf_counter(); timings['close'].append(end - start); start = end
+    cv.bitwise_and(flipped, flipped, mask=tracker)
+    end = time.perf_counter(); timings['bitwiseAnd'].append(end - start); start = end
+    gray = cv.cvtColor(flipped, cv.COLOR_BGR2GRAY)
+    end = time.perf_counter(); timings['gray'].append(end - start); start = end
+    cv.findContours(tracker, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    end = time.perf_counter(); timings['findContours'].append(end - start); start = end
+    pipeline.faceCascade.detectMultiScale(gray, 1.1, 4)
+    end = time.perf_counter(); timings['detectMultiScale'].append(end - start); start = end
+    ## and the real thing, trackers, scheduler and all ##
+    pipeline.process(frame)
+    end = time.perf_counter(); timings['pipeline'].append(end - start)
+
+def summarize(samples):
+    ms = np.array(samples) * 1000
+    mean = float(ms.mean())
+    return { 'mean': mean,
+             'p50': float(np.percentile(ms, 50)),
+             'p95': float(np.percentile(ms, 95)),
+             'p99': float(np.percentile(ms, 99)),
+             'fps': (1000/mean if mean > 0 else None),
+             'samples': len(samples) }
+
+def runBenchmark(clips, hsvBounds=None, maxFrames=None, repeat=1):
+    pipeline = VisionPipeline()
+    if hsvBounds != None:
+        pipeline.hsvBounds = tuple(hsvBounds)
+    timings = { name: [ ] for name in stageNames }
+    frames = 0
+    for r in range(repeat):
+        passFrames = 0
+        for clip in clips:
+            source = openFrameSource(clip)
+            for frame in source.frames():
+                if maxFrames != None and passFrames >= maxFrames:
+                    break
+                timeStages(frame, pipeline, timings)
+                passFrames += 1
+            source.release()
+        frames += passFrames
+    if frames == 0:
+        raise Exception('No frames were read from ' + ', '.join(clips))
+    return { 'clips': clips,
+             'frames': frames,
+             'hsvBounds': list(pipeline.hsvBounds),
+             'opencv': cv.__version__,
+             'python': platform.python_version(),
+             'machine': platform.platform(),
+             'stages': { name: summarize(timings[name]) for name in stageNames } }
+
+def compareToBaseline(results, baseline, threshold=0.2, metric='mean'):
+    # returns a list of (stage, baseline ms, current ms) that got more than
+    # threshold (as a fraction) slower
+    regressions = [ ]
+    for name in baseline['stages']:
+        if name not in results['stages']:
+            continue
+        old = baseline['stages'][name][metric]
+        new = results['stages'][name][metric]
+        if new > old * (1 + threshold):
+            regressions.append( (name, old, new) )
+    return regressions
+
+def printResults(results, baseline=None, metric='mean'):
+    print(f"{results['frames']} frames from {', '.join(results['clips'])}")
+    header = f"{'stage':<18}{'mean':>9}{'p95':>9}{'p99':>9}{'fps':>9}"
+    if baseline != None:
+        header += f"{'base ' + metric:>12}{'change':>9}"
+    print(header)
+    for name in results['stages']:
+        stats = results['stages'][name]
+        line = (f"{name:<18}{stats['mean']:>9.2f}{stats['p95']:>9.2f}"
+                f"{stats['p99']:>9.2f}{stats['fps']:>9.1f}")
+        if baseline != None and name in baseline['stages']:
+            old = baseline['stages'][name][metric]
+            change = (stats[metric] - old)/old * 100 if old > 0 else 0
+            line += f"{old:>12.2f}{change:>+8.1f}%"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-stage vision benchmark')
+    parser.add_argument('clips', nargs='+', help='video files or directories of frames')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='allowed slowdown per stage as a fraction (default 0.2)')
+    parser.add_argument('--metric', default='mean', choices=['mean', 'p50', 'p95', 'p99'])
+    parser.add_argument('--bounds', type=int, nargs=6, metavar='N',
+        help='hsv bounds: hue_l hue_h sat_l sat_h val_l val_h')
+    parser.add_argument('--max-frames', type=int, help='stop each pass after this many frames')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over the clips')
+    args = parser.parse_args(argv)
+
+    results = runBenchmark(args.clips, args.bounds, args.max_frames, args.repeat)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+    printResults(results, baseline, args.metric)
+    if args.out:
+        with open(args.out, 'wt') as f:
+            json.dump(results, f, indent=2)
+    if baseline != None:
+        regressions = compareToBaseline(results, baseline, args.threshold, args.metric)
+        for (name, old, new) in regressions:
+            print(f'REGRESSION: {name} {args.metric} {old:.2f} ms -> {new:.2f} ms')
+        if regressions != [ ]:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+import cv2 as cv
+
+#################################################
+# Frame sources
+#
+# cv.VideoCapture.read() blocks for a whole frame period and OpenCV keeps a
+# small internal buffer, so reading it from timerFired both stalls the Tk
+# loop and hands us old frames. A FrameSource drains its input on its own
+# thread and only ever keeps the newest frame in a lock-protected mailbox.
+#
+# The input is pluggable: a live camera, a recorded video file or a
+# directory of frames, replayed at a fixed rate or as fast as possible.
+# frames() reads the same input synchronously, without the thread, for
+# benchmarks and tests on machines without a camera. A FrameRecorder can be
+# attached to any source to save what it captures.
+#################################################
+
+videoExtensions = ('.avi', '.mp4', '.mov', '.mkv')
+imageExtensions = ('.png', '.jpg', '.jpeg', '.bmp')
+
+class FrameSource(object):
+    # subclasses implement grab() -> (success, frame) and may set self.finished
+    def __init__(self, fps=None, loop=False):
+        ## frames per second to deliver at, None for as fast as they come ##
+        self.fps = fps
+        self.loop = loop
+        self.finished = False
+        self.recorder = None
+        self.lock = threading.Lock()
+        self.newFrame = threading.Condition(self.lock)
+        ## mailbox: newest frame, when it was captured, and how many we've seen ##
+        self.frame = None
+        self.timestamp = None
+        self.seq = 0
+        self.running = False
+        self.thread = None
+
+    def grab(self):
+        raise NotImplementedError
+
+    def rewind(self):
+        pass
+
+    def getNativeFps(self):
+        # the rate frames were captured at, None if unknown
+        return self.fps
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        nextTime = time.perf_counter()
+        while self.running:
+            success, frame = self.grab()
+            if not success:
+                if self.finished and self.loop:
+                    self.finished = False
+                    self.rewind()
+                elif self.finished:
+                    break
+                else:
+                    ## no camera (or it dropped out), don't spin ##
+                    time.sleep(0.01)
+                continue
+            if self.fps:
+                nextTime += 1/self.fps
+                delay = nextTime - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    nextTime = time.perf_counter() # fell behind, don't try to catch up
+            self.post(frame)
+        with self.lock:
+            self.running = False
+            self.newFrame.notify_all()
+
+    def post(self, frame):
+        timestamp = time.perf_counter()
+        if self.recorder != None:
+            self.recorder.write(frame)
+        with self.lock:
+            self.frame = frame
+            self.timestamp = timestamp
+            self.seq += 1
+            self.newFrame.notify_all()
+
+    def frames(self):
+        # synchronous: yields every frame once, as fast as possible, no thread
+        while True:
+            success, frame = self.grab()
+            if not success:
+                if self.finished:
+                    return
+                continue
+            yield frame
+
+    def getLatest(self):
+        # never blocks: returns (seq, timestamp, frame), frame is None until the
+        # first one arrives. Frames are never written to after being posted,
+        # so callers may keep the reference without copying.
+        with self.lock:
+            return self.seq, self.timestamp, self.frame
+
+    def waitForFrame(self, afterSeq=0, timeout=None):
+        with self.lock:
+            self.newFrame.wait_for(lambda: self.seq > afterSeq or not self.running,
+                                   timeout=timeout)
+            return self.seq, self.timestamp, self.frame
+
+    def read(self, timeout=2.0):
+        # same shape as cv.VideoCapture.read(), waits briefly for a first frame
+        seq, timestamp, frame = self.waitForFrame(timeout=timeout)
+        return (frame is not None), frame
+
+    def close(self):
+        pass
+
+    def release(self):
+        if self.running:
+            self.running = False
+            with self.lock:
+                self.newFrame.notify_all()
+        if self.thread != None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+        self.close()
+        if self.recorder != None:
+            self.recorder.release()
+            self.recorder = None
+
+class CameraSource(FrameSource):
+    def __init__(self, index=0):
+        super().__init__()
+        self.cap = cv.VideoCapture(index)
+
+    def grab(self):
+        return self.cap.read()
+
+    def getNativeFps(self):
+        # what the camera reports, None if it doesn't (many return 0)
+        return self.cap.get(cv.CAP_PROP_FPS) or None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def close(self):
+        self.cap.release()
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, fps=None, loop=False):
+        super().__init__(fps=fps, loop=loop)
+        self.path = path
+        self.cap = cv.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise Exception(f'Cannot open video file {path}')
+
+    def getNativeFps(self):
+        return self.cap.get(cv.CAP_PROP_FPS) or None
+
+    def grab(self):
+        success, frame = self.cap.read()
+        if not success:
+            self.finished = True
+        return success, frame
+
+    def rewind(self):
+        self.cap.set(cv.CAP_PROP_POS_FRAMES, 0)
+
+    def close(self):
+        self.cap.release()
+
+class FrameDirectorySource(FrameSource):
+    def __init__(self, path, fps=None, loop=False):
+        super().__init__(fps=fps, loop=loop)
+        self.path = path
+        self.files = sorted(name for name in os.listdir(path)
+                            if name.lower().endswith(imageExtensions))
+        if self.files == [ ]:
+            raise Exception(f'No frames found in {path}')
+        self.index = 0
+
+    def grab(self):
+        if self.index >= len(self.files):
+            self.finished = True
+            return False, None
+        frame = cv.imread(os.path.join(self.path, self.files[self.index]))
+        self.index += 1
+        return (frame is not None), frame
+
+    def rewind(self):
+        self.index = 0
+
+class FrameRecorder(object):
+    # writes a video file if path has a video extension, otherwise numbered
+    # png frames into the directory at path. Give it the source's frame rate,
+    # or the video will replay at the wrong speed; None falls back to 30.
+    def __init__(self, path, fps=None):
+        self.path = path
+        self.fps = fps if fps else 30
+        self.writer = None
+        self.count = 0
+        self.toVideo = path.lower().endswith(videoExtensions)
+        if not self.toVideo:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, frame):
+        if self.toVideo:
+            if self.writer == None:
+                height, width = frame.shape[0], frame.shape[1]
+                codec = 'mp4v' if self.path.lower().endswith('.mp4') else 'MJPG'
+                self.writer = cv.VideoWriter(self.path, cv.VideoWriter_fourcc(*codec),
+                                             self.fps, (width, height))
+            self.writer.write(frame)
+        else:
+            cv.imwrite(os.path.join(self.path, f'frame{self.count:06d}.png'), frame)
+        self.count += 1
+
+    def release(self):
+        if self.writer != None:
+            self.writer.release()
+            self.writer = None
+
+def openFrameSource(spec=0, fps=None, loop=False):
+    # spec is a camera index, a video file or a directory of frames.
+    # fps=None replays files as fast as possible; 'native' uses the file's rate.
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(int(spec))
+    if os.path.isdir(spec):
+        return FrameDirectorySource(spec, fps=(30 if fps == 'native' else fps), loop=loop)
+    source = VideoFileSource(spec, loop=loop)
+    source.fps = source.getNativeFps() if fps == 'native' else fps
+    return source
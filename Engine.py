@@ -0,0 +1,811 @@
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+import numpy as np
+from Scene import SceneBuffer, SceneObject, Trail
+
+#################################################
+# Game engine
+#
+# The rules of VR Pong on their own, without Tk, a camera or images: the
+# ball's flight, its bounces off the walls and paddles, spin, scoring and
+# the opponent's movement, advanced one fixed physics step at a time.
+# GameMode drives an Engine with the tracked paddle; scripts can drive one
+# with a scripted or recorded paddle instead, as fast as the CPU allows.
+#
+#   python Engine.py --rallies 10000 --level 3
+#   python Engine.py --inputs inputs.json       (see python Main.py --record-inputs)
+#   python Engine.py --allocations 20000        (memory churn per step)
+#   python Engine.py --allocations 20000 --scene (and GameMode's scene update)
+#   python Engine.py --check-prediction 1000    (opponent's predictions against doMove)
+#################################################
+
+def interpolate(last, current, alpha):
+    # between the last two physics steps, for drawing (numbers or arrays)
+    return last + (current - last) * alpha
+
+## Player, Opponent and Ball live for the whole game and are updated in
+## place every step, so they use __slots__ rather than a __dict__ each ##
+
+class Player(object):
+    __slots__ = ('x', 'y', 'z', 'width', 'height', 'lastX', 'lastY', 'vx', 'vy')
+
+    def __init__(self, engine):
+        self.x = engine.width/2
+        self.y = engine.height/2
+        self.z = engine.dmarg
+        self.width = 300
+        self.height = 200
+        self.lastX, self.lastY = engine.width/2, engine.height/2
+        self.vx = 0
+        self.vy = 0
+
+    def updateVelocity(self, steps=1):
+        self.vx = (self.x - self.lastX)/steps
+        self.vy = (self.y - self.lastY)/steps
+        self.lastX, self.lastY = self.x, self.y
+
+class Opponent(object):
+    __slots__ = ('x', 'y', 'z', 'width', 'height', 'level', 'prevX', 'prevY',
+                 'baseNoise', 'minNoise', 'baseDelay', 'minDelay',
+                 'prediction', 'reactionLeft')
+
+    def __init__(self, engine):
+        self.x = engine.width/2
+        self.y = engine.height/2
+        self.z = engine.depth
+        self.width = 300
+        self.height = 200
+        self.level = 0
+        self.prevX, self.prevY = self.x, self.y
+        ## aim error (in arena units) and reaction time (in steps) at level 0, and their floors ##
+        self.baseNoise, self.minNoise = 150, 20
+        self.baseDelay, self.minDelay = 8, 1
+        self.prediction = None # (key, x, y) from Engine.predictIntercept
+        self.reactionLeft = 0
+
+    ## both taper off with the level but never reach 0, or nobody could score ##
+    def getNoise(self):
+        return max(self.minNoise, self.baseNoise/(1 + self.level/2))
+
+    def getDelay(self):
+        return max(self.minDelay, round(self.baseDelay/(1 + self.level/2)))
+
+    def getAim(self, engine):
+        # where the ball will reach our plane, give or take our noise, worked
+        # out again only when the ball's path changes (a new serve or a
+        # paddle hit). For a while after that we stay put, as if reacting.
+        key = engine.getPredictionKey()
+        if key == None:
+            return engine.getTarget() # can't predict, just chase
+        if self.prediction == None or self.prediction[0] != key:
+            x, y = engine.predictIntercept()
+            noise = self.getNoise()
+            x += engine.random.uniform(-noise, noise)
+            y += engine.random.uniform(-noise, noise)
+            self.prediction = (key, x, y)
+            self.reactionLeft = self.getDelay()
+        if self.reactionLeft > 0:
+            self.reactionLeft -= 1
+            return self.x, self.y
+        return self.prediction[1], self.prediction[2]
+
+    def getVelocity(self, engine):
+        targetX, targetY = self.getAim(engine)
+        vectorX = targetX - self.x
+        vectorY = targetY - self.y
+        norm = (vectorX**2 + vectorY**2)**0.5
+        if norm == 0:
+            dx, dy = 0, 0
+        else:
+            dx, dy = vectorX/norm, vectorY/norm
+        k = 5
+        maxSpeed = 20 + k * self.level
+        speed = min(maxSpeed, norm)
+        velocity = (speed * dx, speed * dy)
+        return velocity
+
+    def savePosition(self):
+        self.prevX, self.prevY = self.x, self.y
+
+    def getPosition(self, alpha=1):
+        return (interpolate(self.prevX, self.x, alpha), interpolate(self.prevY, self.y, alpha))
+
+class Ball(object):
+    __slots__ = ('r', 'x', 'y', 'z', 'vx', 'vy', 'vz', 'spinX', 'spinY',
+                 'maxBounces', 'lastX', 'lastY', 'lastZ')
+
+    def __init__(self, engine, vx=10, vy=20, vz=-70):
+        self.reset(engine, vx, vy, vz)
+
+    def reset(self, engine, vx=10, vy=20, vz=-70):
+        # back to the serving position, reusing this ball for the next point
+        self.r = 40
+        self.x = engine.width/2
+        self.y = engine.height/2
+        self.z = engine.depth * (7/8)
+        self.vx = vx
+        self.vy = vy
+        self.vz = vz
+        self.spinX = 0
+        self.spinY = 0
+        self.maxBounces = 8 # contacts resolved per step
+        ## where the ball was before the last physics step, for drawing ##
+        self.lastX, self.lastY, self.lastZ = self.x, self.y, self.z
+
+    def savePosition(self):
+        self.lastX, self.lastY, self.lastZ = self.x, self.y, self.z
+
+    def getPosition(self, alpha=1):
+        return (interpolate(self.lastX, self.x, alpha), interpolate(self.lastY, self.y, alpha),
+                interpolate(self.lastZ, self.z, alpha))
+
+    def doMove(self, engine):
+        # Swept: the ball travels its whole step, meeting the walls and the
+        # paddle planes in the order it reaches them, and bouncing off each
+        # at the exact point of contact (appended to engine.contacts as
+        # (kind, x, y, z)). So a fast ball can't skip past a paddle or a wall.
+        # After maxBounces contacts the rest of the step is dropped, leaving
+        # the ball at its last contact rather than moving it unchecked.
+        remaining = 1
+        for bounce in range(self.maxBounces):
+            t, kind = self.getTimeOfImpact(engine, remaining)
+            if kind == None:
+                self.x += self.vx * remaining
+                self.y += self.vy * remaining
+                self.z += self.vz * remaining
+                break
+            self.x += self.vx * t
+            self.y += self.vy * t
+            self.z += self.vz * t
+            remaining -= t
+            engine.contacts.append( (kind, self.x, self.y, self.z) )
+            if kind in ('opponent', 'player'):
+                engine.paddleContacts += 1
+            if not self.checkContact(engine, kind):
+                return # a point, and this ball is out of play
+        self.vx -= self.spinX
+        self.vy -= self.spinY
+
+    def getTimeOfImpact(self, engine, remaining):
+        # the fraction of a step until the first contact within remaining, and what it's with
+        r = self.r
+        best, kind = remaining, None
+        t = self.getTimeTo(self.x, self.vx, r, engine.width - r)
+        if t != None and t <= best:
+            best, kind = t, 'wallX'
+        t = self.getTimeTo(self.y, self.vy, r, engine.height - r)
+        if t != None and t <= best:
+            best, kind = t, 'wallY'
+        if self.vz > 0:
+            t = max(0, (engine.depth - r - self.z)/self.vz)
+            if t <= best:
+                best, kind = t, 'opponent'
+        elif self.vz < 0:
+            t = max(0, (engine.dmarg + r - self.z)/self.vz)
+            if t <= best:
+                best, kind = t, 'player'
+        return best, kind
+
+    @staticmethod
+    def getTimeTo(position, velocity, low, high):
+        # when position, moving at velocity, reaches low or high (or None)
+        if velocity < 0:
+            return max(0, (low - position)/velocity)
+        elif velocity > 0:
+            return max(0, (high - position)/velocity)
+        return None
+
+    def checkContact(self, engine, kind):
+        # bounces off what doMove found; returns False if it was a point
+        r = self.r
+        if kind == 'wallX':
+            self.vx *= -1
+        elif kind == 'wallY':
+            self.vy *= -1
+        elif kind == 'opponent':
+            opponent = engine.opponent
+            if ( (abs(self.x - opponent.x) <= opponent.width/2)
+                and (abs(self.y - opponent.y) <= opponent.height/2) ):
+                self.vz *= -1.05
+                engine.applySpin(opponent = True)
+            else:
+                engine.doScore(player = True)
+                return False
+        elif kind == 'player':
+            player = engine.player
+            if ( (abs(self.x - player.x) <= player.width/2 + 0.5*r)
+                and (abs(self.y - player.y) <= player.height/2 + 0.5*r) ):
+                self.vz *= -1
+                engine.applySpin(player = True)
+            else:
+                engine.doScore(opponent = True)
+                return False
+        return True
+
+    def __repr__(self):
+        return f'Ball: {(self.x, self.y, self.z)}, {(self.vx, self.vy, self.vz)}'
+
+def foldInto(position, low, high):
+    # where a point bouncing between low and high is after travelling
+    # unobstructed to position
+    span = high - low
+    if span <= 0:
+        return low
+    u = (position - low) % (2 * span)
+    if u > span:
+        u = 2*span - u
+    return low + u
+
+def predictAxis(position, velocity, spin, low, high, t):
+    # Where one coordinate of the ball is after t steps, bouncing between low
+    # and high. Without spin the path is a straight line, folded back in off
+    # the walls in one go. Spin changes the velocity once a step, so then we
+    # fold one step's line at a time, flipping the velocity for an odd number
+    # of bounces, exactly as Ball.doMove moves the ball.
+    if spin == 0:
+        return foldInto(position + velocity * t, low, high)
+    span = high - low
+    v = velocity
+    while t > 0:
+        dt = min(1, t)
+        moved = position + v * dt
+        position = foldInto(moved, low, high)
+        if span > 0 and int((moved - low) // span) % 2 != 0:
+            v = -v
+        v -= spin
+        t -= dt
+    return position
+
+class Engine(object):
+    # step() advances one physics step and returns None, or what happened:
+    # 'player' or 'opponent' for whoever scored, or 'roundWon'/'roundLost'
+    # when that point ended the round. A new ball is served after every point.
+    # outcomes lists everything that happened in the step, in order.
+    def __init__(self, width=1000, height=800, depth=3000, dmarg=50, seed=None, recordInputs=False):
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.dmarg = dmarg
+        self.random = random.Random(seed)
+        self.player = Player(self)
+        self.opponent = Opponent(self)
+        self.playerScore = 0
+        self.opponentScore = 0
+        self.outcome = None
+        self.outcomes = [ ]
+        self.contacts = [ ] # (kind, x, y, z) of every contact in the last step
+        self.paddleContacts = 0 # the ball meeting either paddle's plane, hit or miss
+        self.serves = 0
+        self.hits = 0    # player returns since the last serve
+        self.totalHits = 0
+        self.steps = 0
+        ## the player's (x, y) at every step, for RecordedPaddle ##
+        self.inputs = [ ] if recordInputs else None
+        self.ball = None # served once, then reset for every point
+        self.serve()
+
+    def serve(self):
+        x = self.random.randint(-20, 20)
+        y = self.random.randint(-20, 20)
+        z = -80
+        if self.ball == None:
+            self.ball = Ball(self, vx=x, vy=y, vz=z)
+        else:
+            self.ball.reset(self, vx=x, vy=y, vz=z)
+        self.hits = 0
+        self.serves += 1
+
+    def movePlayer(self, x, y):
+        # the paddle stays inside the arena
+        player = self.player
+        player.x = min(max(x, player.width/2), self.width - player.width/2)
+        player.y = min(max(y, player.height/2), self.height - player.height/2)
+
+    def step(self):
+        self.outcome = None
+        self.outcomes.clear()
+        self.contacts.clear()
+        self.steps += 1
+        if self.inputs != None:
+            self.inputs.append( (self.player.x, self.player.y) )
+        ball = self.ball
+        ball.savePosition()
+        self.opponent.savePosition()
+        wasComing = ball.vz < 0
+        ball.doMove(self)
+        if self.outcome == None and wasComing and ball.vz > 0:
+            self.hits += 1
+            self.totalHits += 1
+        self.updateOpponent(self.opponent)
+        return self.outcome
+
+    def getTarget(self):
+        # where the opponent heads for
+        return self.ball.x, self.ball.y
+
+    def getIncoming(self):
+        # (x, y, z) of the ball the player has to deal with next
+        return self.ball.x, self.ball.y, self.ball.z
+
+    def getPredictionKey(self):
+        # changes whenever the ball's path has, other than off a wall, which
+        # predictIntercept already allows for
+        return (self.serves, self.paddleContacts)
+
+    def predictIntercept(self, spin=True):
+        # Where the ball will be when it reaches the opponent's plane, worked
+        # out once from its current flight rather than every tick (see
+        # predictAxis for the walls and spin). A ball still coming at the
+        # player is assumed to be returned straight back.
+        ball = self.ball
+        r = ball.r
+        if ball.vz > 0:
+            t = (self.depth - r - ball.z)/ball.vz
+        elif ball.vz < 0:
+            t = ((self.dmarg + r - ball.z)/ball.vz +
+                 (self.depth - self.dmarg - 2*r)/(-ball.vz))
+        else:
+            return ball.x, ball.y
+        t = max(0, t)
+        spinX, spinY = (ball.spinX, ball.spinY) if spin else (0, 0)
+        return (predictAxis(ball.x, ball.vx, spinX, r, self.width - r, t),
+                predictAxis(ball.y, ball.vy, spinY, r, self.height - r, t))
+
+    def updateOpponent(self, opponent):
+        (vx, vy) = opponent.getVelocity(self)
+        opponent.x += vx
+        if opponent.x > self.width - opponent.width/2:
+            opponent.x = self.width - opponent.width/2
+        elif opponent.x < opponent.width/2:
+            opponent.x = opponent.width/2
+        opponent.y += vy
+        if opponent.y > self.height - opponent.height/2:
+            opponent.y = self.height - opponent.height/2
+        elif opponent.y < opponent.height/2:
+            opponent.y = opponent.height/2
+
+    def applySpin(self, player = False, opponent = False):
+        ## net velocity is viewed from the ball's frame
+        ## Positive net velocity is if the ball has no spin, no vx, and player vx is positive
+        ## spinX is thetawise viewed from the top of the box
+        ## spinY is thetawise from the right of the box
+        ball = self.ball
+        player = self.player
+        opponent = self.opponent
+        if player:
+            netVx = player.vx - ball.spinX - ball.vx
+            netVy = player.vy - ball.spinY - ball.vy
+        elif opponent:
+            netVx = ball.vx - ball.spinX - opponent.vx
+            netVy = opponent.vy - ball.spinY - ball.vy
+        else:
+            pass
+        k = .05
+        ball.spinX = k * netVx
+        ball.spinY = k * netVy
+
+    def doScore(self, player = False, opponent = False):
+        self.addPoint(player, opponent)
+        self.serve()
+
+    def addPoint(self, player = False, opponent = False):
+        if player:
+            self.playerScore += 1
+            self.outcome = 'player'
+        elif opponent:
+            self.opponentScore += 1
+            self.outcome = 'opponent'
+        if self.playerScore == 3:
+            self.endRound(won=True)
+        if self.opponentScore == 3:
+            self.endRound(won=False)
+        self.outcomes.append(self.outcome)
+
+    def endRound(self, won):
+        self.playerScore = 0
+        self.opponentScore = 0
+        if won:
+            self.opponent.level += 1
+            self.outcome = 'roundWon'
+        else:
+            self.opponent.level = 0
+            self.outcome = 'roundLost'
+
+    def saveInputs(self, path):
+        with open(path, 'wt') as f:
+            json.dump(self.inputs, f)
+
+class MultiballEngine(Engine):
+    # The same rules with `balls` balls in play at once, kept as NumPy arrays
+    # (one row per ball) and stepped together. Every missed ball is a point
+    # and is served again on its own; the opponent goes for whichever ball is
+    # closest to getting past it.
+    def __init__(self, width=1000, height=800, depth=3000, dmarg=50, seed=None, recordInputs=False,
+                 balls=5):
+        self.r = 40
+        self.pos = np.zeros((balls, 3))
+        self.vel = np.zeros((balls, 3))
+        self.spin = np.zeros((balls, 2))
+        ## where the balls were before the last physics step, for drawing ##
+        self.lastPos = np.zeros((balls, 3))
+        super().__init__(width, height, depth, dmarg, seed, recordInputs)
+
+    def serve(self, balls=None):
+        # serves every ball, or just the ones indexed by balls
+        if balls is None:
+            balls = np.arange(len(self.pos))
+            self.hits = 0
+        n = len(balls)
+        self.pos[balls] = (self.width/2, self.height/2, self.depth * (7/8))
+        self.lastPos[balls] = self.pos[balls]
+        self.vel[balls, 0] = [ self.random.randint(-20, 20) for i in range(n) ]
+        self.vel[balls, 1] = [ self.random.randint(-20, 20) for i in range(n) ]
+        self.vel[balls, 2] = -80
+        self.spin[balls] = 0
+
+    def getPositions(self, alpha=1):
+        return interpolate(self.lastPos, self.pos, alpha)
+
+    def getPredictionKey(self):
+        # too many balls to predict, the opponent chases getTarget instead
+        return None
+
+    def getTarget(self):
+        # the ball heading away from the player that is deepest in, else the deepest
+        z = np.where(self.vel[:, 2] > 0, self.pos[:, 2], self.pos[:, 2] - self.depth)
+        i = int(np.argmax(z))
+        return self.pos[i, 0], self.pos[i, 1]
+
+    def getIncoming(self):
+        # the ball heading for the player that is closest, else the closest
+        z = np.where(self.vel[:, 2] < 0, self.pos[:, 2], self.pos[:, 2] + self.depth)
+        i = int(np.argmin(z))
+        return tuple(self.pos[i].tolist())
+
+    def step(self):
+        self.outcome = None
+        self.outcomes.clear()
+        self.contacts.clear()
+        self.steps += 1
+        if self.inputs != None:
+            self.inputs.append( (self.player.x, self.player.y) )
+        self.lastPos[:] = self.pos
+        self.opponent.savePosition()
+        self.moveBalls()
+        self.checkContacts()
+        self.updateOpponent(self.opponent)
+        return self.outcome
+
+    def moveBalls(self):
+        self.pos += self.vel
+        self.vel[:, :2] -= self.spin
+
+    def checkContacts(self):
+        # Ball.checkContact, for every ball at once
+        r, pos, vel = self.r, self.pos, self.vel
+        for axis, size in [ (0, self.width), (1, self.height) ]:
+            low = pos[:, axis] - r <= 0
+            high = (pos[:, axis] + r >= size) & ~low
+            vel[low | high, axis] *= -1
+            pos[low, axis] = r
+            pos[high, axis] = size - r
+        x, y = pos[:, 0], pos[:, 1]
+        opponent, player = self.opponent, self.player
+        far = pos[:, 2] + r >= self.depth
+        returned = (far & (abs(x - opponent.x) <= opponent.width/2) &
+                           (abs(y - opponent.y) <= opponent.height/2))
+        near = (pos[:, 2] - r <= self.dmarg) & ~far
+        hit = (near & (abs(x - player.x) <= player.width/2 + 0.5*r) &
+                      (abs(y - player.y) <= player.height/2 + 0.5*r))
+        vel[returned, 2] *= -1.05
+        pos[returned, 2] = self.depth - r
+        vel[hit, 2] *= -1
+        pos[hit, 2] = r + self.dmarg
+        self.applySpins(returned | hit)
+        self.hits += int(np.count_nonzero(hit))
+        self.totalHits += int(np.count_nonzero(hit))
+        missedFar = np.flatnonzero(far & ~returned)
+        missedNear = np.flatnonzero(near & ~hit)
+        for i in missedFar:
+            self.addPoint(player = True)
+        for i in missedNear:
+            self.addPoint(opponent = True)
+        missed = np.concatenate([missedFar, missedNear])
+        if len(missed) > 0:
+            self.serve(missed)
+
+    def applySpins(self, balls):
+        # as Engine.applySpin, which always spins off the player's paddle
+        k = .05
+        player = self.player
+        self.spin[balls, 0] = k * (player.vx - self.spin[balls, 0] - self.vel[balls, 0])
+        self.spin[balls, 1] = k * (player.vy - self.spin[balls, 1] - self.vel[balls, 1])
+
+class PhysicsClock(object):
+    # Fixed timestep: tick() banks the real time since the last tick, and each
+    # consume() spends one stepTime of it on a physics step. At most
+    # maxSubsteps run per tick, so after a long stall the game slows down for
+    # a moment instead of spiralling. alpha is how far we are into the next
+    # step, for drawing between the last two.
+    def __init__(self, stepTime=1/30, maxSubsteps=4):
+        self.stepTime = stepTime
+        self.maxSubsteps = maxSubsteps
+        self.reset()
+
+    def reset(self):
+        # drop any banked time, the next tick starts the clock again
+        self.lastTime = None
+        self.accumulator = 0
+        self.substeps = 0
+        self.alpha = 1
+
+    def tick(self, now):
+        if self.lastTime != None:
+            self.accumulator += now - self.lastTime
+        self.lastTime = now
+        self.substeps = 0
+        self.alpha = min(1, self.accumulator/self.stepTime)
+
+    def getPendingSteps(self):
+        return min(int(self.accumulator/self.stepTime), self.maxSubsteps)
+
+    def consume(self):
+        if self.accumulator < self.stepTime:
+            return False
+        if self.substeps == self.maxSubsteps:
+            ## too far behind, let the rest go ##
+            self.accumulator = 0
+            self.alpha = 1
+            return False
+        self.accumulator -= self.stepTime
+        self.substeps += 1
+        self.alpha = self.accumulator/self.stepTime
+        return True
+
+#################################################
+# Paddles for headless play: called once per step with the engine, they
+# return where the player's paddle should be
+#################################################
+
+class TrackingPaddle(object):
+    # follows the ball at up to maxSpeed per step, aiming off by up to noise
+    def __init__(self, maxSpeed=40, noise=0, seed=None):
+        self.maxSpeed = maxSpeed
+        self.noise = noise
+        self.random = random.Random(seed)
+
+    def __call__(self, engine):
+        player = engine.player
+        x, y = player.x, player.y
+        ballX, ballY, ballZ = engine.getIncoming()
+        targetX = ballX + self.random.uniform(-self.noise, self.noise)
+        targetY = ballY + self.random.uniform(-self.noise, self.noise)
+        dx = min(max(targetX - x, -self.maxSpeed), self.maxSpeed)
+        dy = min(max(targetY - y, -self.maxSpeed), self.maxSpeed)
+        return (x + dx, y + dy)
+
+class RecordedPaddle(object):
+    # replays the (x, y) positions saved by Engine.saveInputs
+    def __init__(self, positions, loop=True):
+        if len(positions) == 0:
+            raise Exception('No paddle positions to replay')
+        self.positions = positions
+        self.loop = loop
+        self.index = 0
+
+    @staticmethod
+    def load(path, loop=True):
+        with open(path, 'rt') as f:
+            return RecordedPaddle(json.load(f), loop=loop)
+
+    def __call__(self, engine):
+        if self.index >= len(self.positions):
+            self.index = 0 if self.loop else len(self.positions) - 1
+        x, y = self.positions[self.index]
+        self.index += 1
+        return (x, y)
+
+def simulateRallies(rallies=1000, paddle=None, level=0, seed=None, maxSteps=2000, balls=1):
+    # plays rallies back to back against an opponent held at level, and
+    # returns how they went and how fast they ran. With more than one ball a
+    # rally ends at the first point.
+    if balls > 1:
+        engine = MultiballEngine(seed=seed, balls=balls)
+    else:
+        engine = Engine(seed=seed)
+    if paddle == None:
+        paddle = TrackingPaddle(seed=seed)
+    results = { 'rallies': rallies, 'player': 0, 'opponent': 0, 'timeouts': 0,
+                'hits': 0, 'steps': 0 }
+    start = time.perf_counter()
+    for rally in range(rallies):
+        engine.opponent.level = level
+        for step in range(maxSteps):
+            x, y = paddle(engine)
+            engine.movePlayer(x, y)
+            engine.player.updateVelocity()
+            outcome = engine.step()
+            if outcome != None:
+                results['player' if outcome in ('player', 'roundWon') else 'opponent'] += 1
+                break
+        else:
+            results['timeouts'] += 1
+            engine.serve()
+    seconds = time.perf_counter() - start
+    results['hits'] = engine.totalHits
+    results['steps'] = engine.steps
+    results['seconds'] = seconds
+    results['meanHits'] = results['hits'] / rallies if rallies > 0 else 0
+    results['ralliesPerSecond'] = rallies / seconds if seconds > 0 else None
+    results['stepsPerSecond'] = engine.steps / seconds if seconds > 0 else None
+    return results
+
+def checkPredictions(cases=1000, seed=None):
+    # Engine.predictIntercept against the real thing: serves random spinning
+    # balls at the opponent, steps each until it reaches the opponent's
+    # plane, and returns how far off the predictions were, worst first
+    rng = random.Random(seed)
+    errors = [ ]
+    for case in range(cases):
+        engine = Engine(seed=rng.random())
+        ball = engine.ball
+        r = ball.r
+        ball.x = rng.uniform(r, engine.width - r)
+        ball.y = rng.uniform(r, engine.height - r)
+        ball.z = rng.uniform(engine.dmarg + r, engine.depth - r)
+        ball.vx, ball.vy = rng.uniform(-40, 40), rng.uniform(-40, 40)
+        ball.vz = rng.uniform(40, 120)
+        ball.spinX, ball.spinY = rng.uniform(-3, 3), rng.uniform(-3, 3)
+        x, y = engine.predictIntercept()
+        for step in range(1000):
+            engine.step()
+            arrived = [ c for c in engine.contacts if c[0] == 'opponent' ]
+            if arrived != [ ]:
+                (kind, actualX, actualY, actualZ) = arrived[0]
+                errors.append(max(abs(x - actualX), abs(y - actualY)))
+                break
+    errors.sort(reverse=True)
+    return errors
+
+def measureAllocations(steps=20000, paddle=None, level=0, seed=None, balls=1, warmup=500,
+                       scene=False, trailLength=6):
+    # Memory churn per step of headless play: bytes allocated and freed again
+    # within a step (tracemalloc's peak over the step), memory blocks still
+    # held at the end, and the garbage collections that ran meanwhile, which
+    # are what a long session feels as stutter. With scene, every step also
+    # does what GameMode does with it, minus the drawing: adds to the ball's
+    # trail, moves the boxes and ball lines, and projects the scene.
+    if balls > 1:
+        engine = MultiballEngine(seed=seed, balls=balls)
+    else:
+        engine = Engine(seed=seed)
+    engine.opponent.level = level
+    if paddle == None:
+        paddle = TrackingPaddle(seed=seed)
+
+    if scene:
+        buffer = SceneBuffer()
+        ballBox, opponentBox, playerBox = [ SceneObject(buffer) for i in range(3) ]
+        ballLines = [ SceneObject(buffer) for i in range(4) ]
+        trail = Trail(buffer, trailLength)
+
+    def updateScene():
+        # GameMode.makeBallTrail and projectAll
+        if balls > 1:
+            x, y, z = engine.getIncoming()
+            r = engine.r
+        else:
+            ball = engine.ball
+            trail.add( (ball.x, ball.y, ball.z) )
+            x, y, z = ball.getPosition()
+            r = ball.r
+        ballBox.setPoints( (x - r, y - r, z), (x + r, y + r, z) )
+        for line in ballLines:
+            buffer.points[line.row:line.row + 2, 2] = z
+        for (box, paddle) in [ (opponentBox, engine.opponent), (playerBox, engine.player) ]:
+            x, y = paddle.x, paddle.y
+            box.setPoints( (x - paddle.width/2, y - paddle.height/2, paddle.z),
+                           (x + paddle.width/2, y + paddle.height/2, paddle.z) )
+        buffer.project(engine.width/2, engine.height/2, 1000)
+
+    def doStep():
+        x, y = paddle(engine)
+        engine.movePlayer(x, y)
+        engine.player.updateVelocity()
+        engine.step()
+        if scene:
+            updateScene()
+
+    for step in range(warmup):
+        doStep()
+    collections = [0, 0, 0]
+    pauses = [ ]
+    def onCollect(phase, info):
+        if phase == 'start':
+            pauses.append(time.perf_counter())
+        else:
+            collections[info['generation']] += 1
+            pauses[-1] = time.perf_counter() - pauses[-1]
+    gc.collect()
+    gc.callbacks.append(onCollect)
+    tracemalloc.start()
+    ignore = [ tracemalloc.Filter(False, tracemalloc.__file__) ]
+    before = tracemalloc.take_snapshot().filter_traces(ignore)
+    transient = 0
+    for step in range(steps):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        doStep()
+        transient += tracemalloc.get_traced_memory()[1] - current
+    after = tracemalloc.take_snapshot().filter_traces(ignore)
+    tracemalloc.stop()
+    gc.callbacks.remove(onCollect)
+    diff = after.compare_to(before, 'filename')
+    return { 'steps': steps,
+             'transientBytesPerStep': transient / steps,
+             'retainedBlocksPerStep': sum(stat.count_diff for stat in diff) / steps,
+             'retainedBytesPerStep': sum(stat.size_diff for stat in diff) / steps,
+             'collections': collections,
+             'collectionsPer1000Steps': sum(collections) * 1000 / steps,
+             'collectionMs': sum(pauses) * 1000 }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless VR Pong rallies')
+    parser.add_argument('--rallies', type=int, default=1000)
+    parser.add_argument('--level', type=int, default=0, help='opponent level')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--max-steps', type=int, default=2000, help='give up on a rally after this many steps')
+    parser.add_argument('--inputs', help='replay paddle positions recorded with Main.py --record-inputs')
+    parser.add_argument('--speed', type=float, default=40, help='tracking paddle speed per step')
+    parser.add_argument('--noise', type=float, default=0, help='tracking paddle aim error')
+    parser.add_argument('--balls', type=int, default=1, help='balls in play at once')
+    parser.add_argument('--check-prediction', type=int, metavar='CASES',
+        help='compare the opponent\'s predictions with stepping this many random balls')
+    parser.add_argument('--allocations', type=int, metavar='STEPS',
+        help='measure memory churn over this many steps instead of playing rallies')
+    parser.add_argument('--scene', action='store_true',
+        help='with --allocations, also update and project the scene as GameMode does')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    if args.inputs:
+        paddle = RecordedPaddle.load(args.inputs)
+    else:
+        paddle = TrackingPaddle(maxSpeed=args.speed, noise=args.noise, seed=args.seed)
+    if args.check_prediction:
+        errors = checkPredictions(args.check_prediction, args.seed)
+        worst = errors[0] if errors != [ ] else 0
+        print(f'{len(errors)} predictions: worst off by {worst:.3g}, '
+              f'{sum(1 for e in errors if e > 1)} off by more than 1')
+        return 0 if worst <= 1 else 1
+    if args.allocations:
+        results = measureAllocations(args.allocations, paddle, args.level, args.seed, args.balls,
+                                     scene=args.scene)
+        print(f"{results['steps']} steps: {results['transientBytesPerStep']:.0f} bytes allocated "
+              f"and freed per step, {results['retainedBlocksPerStep']:.3f} blocks "
+              f"({results['retainedBytesPerStep']:.1f} bytes) kept per step")
+        print(f"{sum(results['collections'])} collections by generation {results['collections']} "
+              f"({results['collectionsPer1000Steps']:.2f} per 1000 steps), "
+              f"{results['collectionMs']:.2f} ms collecting")
+        if args.out:
+            with open(args.out, 'wt') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    results = simulateRallies(args.rallies, paddle, args.level, args.seed, args.max_steps, args.balls)
+    print(f"{results['rallies']} rallies at level {args.level}: player {results['player']}, "
+          f"opponent {results['opponent']}, unfinished {results['timeouts']}")
+    print(f"{results['meanHits']:.2f} returns per rally, {results['steps']} steps in "
+          f"{results['seconds']:.2f} s ({results['ralliesPerSecond']:.0f} rallies/s, "
+          f"{results['stepsPerSecond']:.0f} steps/s)")
+    if args.out:
+        with open(args.out, 'wt') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import os
+import bisect
+
+#################################################
+# Leaderboard
+#
+# Leaderboard.txt holds one 'TAG, #score' line per game. The file is a log:
+# new scores are appended to the end of it and it is never rewritten, so
+# saving a score costs the same however long the leaderboard gets. Scores
+# are read once, into an index kept sorted best first, which answers the
+# top k, or the rank of a score, without going through the whole list.
+#
+# Equal scores rank in the order they were played, earliest first.
+#################################################
+
+class Leaderboard(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.index = [ ] # (-score, seq, tag), sorted, so best first
+        self.seq = 0     # how many scores have been read or added
+        ## the log is written to, so a last line without a newline needs one ##
+        self.needsNewline = False
+
+    @staticmethod
+    def load(path):
+        leaderboard = Leaderboard(path)
+        if os.path.exists(path):
+            with open(path, 'rt') as f:
+                contents = f.read()
+            for line in contents.splitlines():
+                entry = Leaderboard.parseLine(line)
+                if entry != None:
+                    leaderboard.index.append( (-entry[1], leaderboard.seq, entry[0]) )
+                    leaderboard.seq += 1
+            leaderboard.index.sort()
+            leaderboard.needsNewline = (contents != '') and not contents.endswith('\n')
+        return leaderboard
+
+    @staticmethod
+    def parseLine(line):
+        # 'CHRIS, #3' -> ('CHRIS', 3), or None for a line that isn't a score
+        tag, sep, score = line.strip().rpartition(', #')
+        if sep == '' or not score.isdigit():
+            return None
+        return (tag, int(score))
+
+    @staticmethod
+    def formatLine(tag, score):
+        return f'{tag}, #{score}'
+
+    def add(self, tag, score):
+        # logs the score and returns its rank, 1 being the best. insort finds
+        # the place in O(log n) but inserting shifts the rest of the list, an
+        # O(n) memmove of pointers; at 50,000 scores that's about 10 us an
+        # add, so a balanced tree isn't worth it here
+        key = (-score, self.seq, tag)
+        self.seq += 1
+        bisect.insort(self.index, key)
+        if self.path != None:
+            with open(self.path, 'at') as f:
+                if self.needsNewline:
+                    f.write('\n')
+                    self.needsNewline = False
+                f.write(self.formatLine(tag, score) + '\n')
+        return bisect.bisect_left(self.index, key) + 1
+
+    def getTop(self, k):
+        # the k best (tag, score), best first
+        return [ (tag, -negScore) for (negScore, seq, tag) in self.index[:k] ]
+
+    def getRank(self, score):
+        # 1 + how many scores beat score, so equal scores share a rank
+        return bisect.bisect_left(self.index, (-score,)) + 1
+
+    def __len__(self):
+        return len(self.index)
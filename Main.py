@@ -7,7 +7,12 @@ from matplotlib import pyplot as plt
 from cmu_112_graphics import *
 from tkinter import *
 from PIL import Image
-import random
+import time
+from Camera import openFrameSource, FrameRecorder
+from Vision import VisionPipeline, VisionProcess, ColorModel, getLargestFace, shared_memory
+from Scene import SceneBuffer, SceneObject, ProjectionCache, Trail
+from Engine import Engine, MultiballEngine, PhysicsClock
+from Leaderboard import Leaderboard
 
 print('loaded cv version: ', cv.__version__)
 
@@ -22,16 +27,18 @@ print('loaded cv version: ', cv.__version__)
 def nothing(x):
     pass
 
-def getKthDigit(n, k):
-    return (n//10**k)%10
+def getHSVStats(samples):
+    # robust per-channel (h, s, v) statistics of an (n, 3) array of pixels
+    return { 'median': np.median(samples, axis=0),
+             'low': np.percentile(samples, 5, axis=0),
+             'high': np.percentile(samples, 95, axis=0) }
 
-def readFile(path):
-    with open(path, "rt") as f:
-        return f.read()
-
-def writeFile(path, contents):
-    with open(path, "wt") as f:
-        f.write(contents)
+def getLeaderboardText(leaderboard, k):
+    # the top k as numbered lines of tag, then score, for GameOverMode and LeaderboardMode
+    s = ''
+    for (i, (tag, score)) in enumerate(leaderboard.getTop(k)):
+        s += f'{i+1}.  {tag:<10}\t\t{score}\n'
+    return s
 
 
 class CalibrationMode(Mode):
@@ -43,10 +50,12 @@ class CalibrationMode(Mode):
         mode.imageScale = 1.0
         mode.image = mode.app.frame
         mode.hsvImage = cv.cvtColor(mode.image, cv.COLOR_BGR2HSV)
-        mode.hueList = [ ]
-        mode.satList = [ ]
-        mode.valList = [ ]
+        mode.clickStats = [ ]
+        mode.clickSamples = [ ]
         mode.clicks =  [ ]
+        ## each click samples a (2r+1) square, or a 3x3 grid of them ##
+        mode.sampleRadius = 10
+        mode.sampleGrid = False
 
         mode.homeImage = mode.loadImage('Home.png')
         mode.homeBounds = (mode.width*(6.5/16), mode.height*(13.2/16),
@@ -55,11 +64,12 @@ class CalibrationMode(Mode):
         mode.x, mode.y = 0, 0
 
     def timerFired(mode):
-        mode.app.processImage()
+        mode.app.visionPriority = 'paddle'
+        with mode.app.timed('vision'):
+            mode.app.processImage()
         mode.image = mode.app.frame
-        mode.hsvImage = cv.cvtColor(mode.image, cv.COLOR_BGR2HSV)
         if mode.showMask:
-            cv.imshow('result', mode.app.result)
+            cv.imshow('result', mode.app.getResultImage())
 
     def keyPressed(mode, event):
         if event.key == 'g':
@@ -71,12 +81,18 @@ class CalibrationMode(Mode):
             else:
                 mode.showMask = True
         elif event.key == 'Space':
-            mode.hueList = [ ]
-            mode.satList = [ ]
-            mode.valList = [ ]
+            mode.clickStats = [ ]
+            mode.clickSamples = [ ]
             mode.clicks = [ ]  
+            mode.app.colorModel = None
         elif event.key == 'h':
             print(mode.app.hsvBounds)
+        elif event.key == 'Up':
+            mode.sampleRadius = min(mode.sampleRadius + 5, 100)
+        elif event.key == 'Down':
+            mode.sampleRadius = max(mode.sampleRadius - 5, 1)
+        elif event.key == 'n':
+            mode.sampleGrid = not mode.sampleGrid
 
     def mouseMoved(mode, event):
         mode.x, mode.y = event.x, event.y
@@ -86,55 +102,68 @@ class CalibrationMode(Mode):
         hx0, hy0, hx1, hy1 = mode.homeBounds
         if ( (hx0 <= x <= hx1) and (hy0 <= y <= hy1) ):
             mode.app.setActiveMode(mode.app.splashScreenMode)
-        if mode.mapClickToFrame(x, y) == None:
+        click = mode.mapClickToFrame(x, y)
+        if click == None:
             return
-        imgX, imgY = mode.mapClickToFrame(x, y)
-        meanHue, meanSat, meanVal = mode.getRegionHSV(imgX, imgY)
-        mode.hueList.append(meanHue)
-        mode.satList.append(meanSat)
-        mode.valList.append(meanVal)
+        imgX, imgY = click
+        ## only convert when we actually sample, not every tick ##
+        mode.hsvImage = cv.cvtColor(mode.image, cv.COLOR_BGR2HSV)
+        samples = mode.getClickSamples(imgX, imgY)
+        mode.clickStats.append(getHSVStats(samples))
+        mode.clickSamples.append(samples)
         mode.updateMask()
 
-    def getRegionHSV(mode, imgX, imgY):
+    def getRegionHSV(mode, imgX, imgY, radius=10):
+        # every pixel of the (2r+1) square around (imgX, imgY) that is inside
+        # the image, as an (n, 3) array of hsv rows
         image = mode.hsvImage
-        hues = [ ]
-        sats = [ ]
-        vals = [ ]
-        for x in range(imgX-10, imgX+11):
-            if x < 0 or x > image.shape[1]:
-                continue
-            for y in range(imgY-10, imgY+11):
-                if y < 0 or y > image.shape[0]:
-                    continue
-                hues.append(image[y,x,0])
-                sats.append(image[y,x,1])
-                vals.append(image[y,x,2])
-        meanHue = sum(hues)/len(hues)
-        meanSat = sum(sats)/len(sats)
-        meanVal = sum(vals)/len(vals)
-        return meanHue, meanSat, meanVal
+        height, width = image.shape[0], image.shape[1]
+        x0, x1 = max(0, imgX - radius), min(width, imgX + radius + 1)
+        y0, y1 = max(0, imgY - radius), min(height, imgY + radius + 1)
+        return image[y0:y1, x0:x1].reshape(-1, 3)
+
+    def getSampleOffsets(mode):
+        if not mode.sampleGrid:
+            return [ (0, 0) ]
+        step = 2 * mode.sampleRadius + 1
+        return [ (dx * step, dy * step) for dx in (-1, 0, 1) for dy in (-1, 0, 1) ]
+
+    def getClickSamples(mode, imgX, imgY):
+        regions = [ mode.getRegionHSV(imgX + dx, imgY + dy, mode.sampleRadius)
+                    for (dx, dy) in mode.getSampleOffsets() ]
+        return np.concatenate(regions)
 
     def mapClickToFrame(mode, x, y):
         image = mode.image
         width, height = image.shape[1], image.shape[0]
         imgX = int(x + (width/2) * mode.imageScale - mode.imageX)
         imgY = int(y + (height/2) * mode.imageScale - mode.imageY)
-        if (imgX < 0) or (imgX > width) or (imgY < 0) or (imgY > height):
+        if (imgX < 0) or (imgX >= width) or (imgY < 0) or (imgY >= height):
             return None
-        mode.clicks.append( (imgX-5, imgY-5, imgX+5, imgY+5) )
+        r = mode.sampleRadius
+        if mode.sampleGrid:
+            r += 2 * mode.sampleRadius + 1
+        mode.clicks.append( (imgX-r, imgY-r, imgX+r, imgY+r) )
         return (imgX, imgY)
 
     def updateMask(mode):
-        if mode.hueList == [ ]:
+        if mode.clickStats == [ ]:
             mode.app.hsvBounds = (0, 0, 0, 255, 255, 255)
-        hList = mode.hueList
-        sList = mode.satList
-        vList = mode.valList
-        
-        hue_l, hue_h = int(min(mode.hueList) - 10), int(max(mode.hueList) + 10)
-        sat_l, sat_h = int(min(mode.satList) - 20), int(max(mode.satList) + 40)
-        val_l, val_h = int(min(mode.valList) - 20), int(max(mode.valList) + 20)
+            return
+        ## pad the medians like we used to pad the means, but always keep the
+        ## 5th-95th percentile spread of every click inside the box ##
+        medians = np.array([ stats['median'] for stats in mode.clickStats ])
+        lows = np.array([ stats['low'] for stats in mode.clickStats ])
+        highs = np.array([ stats['high'] for stats in mode.clickStats ])
+        lowMargin = np.array([10, 20, 20])
+        highMargin = np.array([10, 40, 20])
+        low = np.minimum(medians.min(axis=0) - lowMargin, lows.min(axis=0))
+        high = np.maximum(medians.max(axis=0) + highMargin, highs.max(axis=0))
+        hue_l, sat_l, val_l = [ int(v) for v in low ]
+        hue_h, sat_h, val_h = [ int(v) for v in high ]
         mode.app.hsvBounds = (hue_l, hue_h, sat_l, sat_h, val_l, val_h)
+        ## the tracker itself uses a lookup table built from every sampled pixel ##
+        mode.app.colorModel = ColorModel(np.concatenate(mode.clickSamples))
 
     def getColor(mode, button='default'):
         neonBlue = '#00ffff'
@@ -166,9 +195,14 @@ class CalibrationMode(Mode):
         canvas.create_text(mode.width/2, mode.height * (2.5/16), 
             text=f'Press \'Space\' to reset on a misclick.',
             fill=color, font=font)         
+        size = 2 * mode.sampleRadius + 1
+        grid = '3x3 grid of ' if mode.sampleGrid else ''
+        canvas.create_text(mode.width/2, mode.height * (3/16),
+            text=f'Sampling a {grid}{size}x{size} region (Up/Down to resize, \'n\' for a grid).',
+            fill=color, font=font)
 
         canvas.create_image(mode.width/2, mode.height * (14/16),
-            image=ImageTk.PhotoImage(mode.homeImage))
+            pilImage=mode.homeImage)
         hx0, hy0, hx1, hy1 = mode.homeBounds
         canvas.create_rectangle(hx0, hy0, hx1, hy1, outline=mode.getColor(button='home'))
 
@@ -203,7 +237,6 @@ class GameOverMode(Mode):
         mode.gamerTag = [ ]
         mode.timer = 0
         mode.enterPressed = False
-        mode.leaderboardTxt = readFile('Leaderboard.txt')
 
     def keyPressed(mode, event):
         key = str(event.key).upper()
@@ -216,7 +249,6 @@ class GameOverMode(Mode):
             if len(mode.gamerTag) > 0:
                 mode.enterPressed = True
                 mode.saveScore()
-                mode.leaderboardTxt = leaderboardTxt = readFile('Leaderboard.txt')
         elif key in string.ascii_uppercase:
             char = key.upper()
             mode.gamerTag.append(char)
@@ -224,28 +256,10 @@ class GameOverMode(Mode):
                 mode.gamerTag.pop()
 
     def saveScore(mode):
+        ## appended to Leaderboard.txt as 'CHRIS, #3', see Leaderboard.py ##
         gamerScore = mode.app.score
         gamerTag = ''.join(mode.gamerTag)
-        data = f'{gamerTag}, #{gamerScore}' #'CHRIS, #3'
-        added = False
-        leaderboard = readFile('Leaderboard.txt')
-        leaderboard = leaderboard.strip()
-        if leaderboard == '':
-            newLeaderboard = data
-        else:
-            leaderboardList = leaderboard.splitlines()
-            for i in range(len(leaderboardList)):
-                leaderboardData = leaderboardList[i]
-                j = 1 + leaderboardData.index('#')
-                leaderboardScore = int(leaderboardData[j:])
-                if leaderboardScore < gamerScore:
-                    leaderboardList.insert(i, f'{data}')
-                    newLeaderboard = '\n'.join(leaderboardList)
-                    added = True
-                    break
-            if added == False:
-                newLeaderboard = leaderboard + f'\n{data}'
-        writeFile('Leaderboard.txt', newLeaderboard)
+        mode.app.leaderboard.add(gamerTag, gamerScore)
 
 
 
@@ -298,17 +312,17 @@ class GameOverMode(Mode):
         gameOverRed = '#FF163E'
         canvas.create_rectangle(0, 0, mode.width, mode.height, fill='black')
         canvas.create_image(mode.width/2, mode.height * (2/16), 
-            image=ImageTk.PhotoImage(mode.gameOverImage))
+            pilImage=mode.gameOverImage)
         canvas.create_image(mode.width * (4/16), mode.height * (14.5/16), 
-            image=ImageTk.PhotoImage(mode.playAgainImage))
+            pilImage=mode.playAgainImage)
         px0, py0, px1, py1 = mode.playAgainBounds
         canvas.create_rectangle(px0, py0, px1, py1, outline=mode.getColor(button='playAgain'))
         canvas.create_image(mode.width * (9.5/16), mode.height * (14.5/16), 
-            image=ImageTk.PhotoImage(mode.quitImage))
+            pilImage=mode.quitImage)
         qx0, qy0, qx1, qy1 = mode.quitBounds
         canvas.create_rectangle(qx0, qy0, qx1, qy1, outline=mode.getColor(button='quit'))
         canvas.create_image(mode.width * (13.2/16), mode.height * (14.5/16), 
-            image=ImageTk.PhotoImage(mode.homeImage))
+            pilImage=mode.homeImage)
         hx0, hy0, hx1, hy1 = mode.homeBounds
         canvas.create_rectangle(hx0, hy0, hx1, hy1, outline=mode.getColor(button='home'))
         font = 'system 40 roman'
@@ -322,24 +336,7 @@ class GameOverMode(Mode):
         mode.drawLeaderboard(canvas)
     
     def drawLeaderboard(mode, canvas):
-        s = ''
-        leaderboardList = mode.leaderboardTxt.strip().splitlines()
-        for i in range(min(len(leaderboardList), 5)):
-            data = leaderboardList[i]
-            formattedScore = ''
-            hitNumber = False
-            for c in data:
-                if c.isalpha():
-                    formattedScore += c
-                elif c.isnumeric():
-                    while len(formattedScore) < 10:
-                        formattedScore += ' '
-                    if not hitNumber:
-                        formattedScore += '\t\t'
-                        hitNumber = True
-
-                    formattedScore += c 
-            s += f'{i+1}.  {formattedScore}\n'
+        s = getLeaderboardText(mode.app.leaderboard, 5)
         font= 'system 30 roman'
         color = '#edff00'
         canvas.create_text(mode.width * (8/16), mode.height* (5.3/16), font=font, fill=color,
@@ -371,8 +368,6 @@ class GameOverMode(Mode):
 class RoundWonMode(Mode):
     def appStarted(mode):
         mode.roundImage = mode.scaleImage(mode.loadImage('Round.png'), 0.5)
-        img = mode.loadImage('NumbersRed.png')
-        mode.numberImage = mode.scaleImage(img, 0.5)
         mode.timer = 0
 
     def keyPressed(mode, event):
@@ -389,39 +384,18 @@ class RoundWonMode(Mode):
         mode.app.level += 1
         mode.app.setActiveMode(mode.app.gameMode)
 
-    def getNumberImage(mode, n):
-        k = 0
-        digitImage = mode.numberImage.crop( (0, k + 121.5*n, 100, k + 121.5*(n+1)) )
-        digitImage = mode.scaleImage(digitImage, 2)
-        return digitImage
-
     def redrawAll(mode, canvas):
         canvas.create_rectangle(0, 0, mode.width, mode.height, fill='black')
         canvas.create_image(mode.width * (6.5/16), mode.height/2,
-            image=ImageTk.PhotoImage(mode.roundImage))
+            pilImage=mode.roundImage)
         mode.displayLevel(canvas)
 
     def displayLevel(mode, canvas):
-        level = mode.app.level
-        if level < 10:
-            numberImg = mode.scaleImage(mode.getNumberImage(level), .5)
-            canvas.create_image(mode.width * (11/16), mode.height/2,
-                image=ImageTk.PhotoImage(numberImg))
-        elif 10 <= level < 100:
-            digit0 = getKthDigit(level, 0)
-            digit0Img = mode.scaleImage(mode.getNumberImage(digit0), .5)
-            digit1 = getKthDigit(level, 1)
-            digit1Img = mode.scaleImage(mode.getNumberImage(digit1), .5)
-            canvas.create_image(mode.width * (11/16), mode.height/2,
-                image=ImageTk.PhotoImage(digit1Img))
-            canvas.create_image(mode.width * (12.2/16), mode.height/2,
-                image=ImageTk.PhotoImage(digit0Img))
-        else:
-            print('get a life')
+        mode.app.digitAtlas.drawNumber(canvas, mode.app.level, mode.width * (11/16), mode.height/2,
+                                       scale=.5, spacing=mode.width * (1.2/16))
 
 class LeaderboardMode(Mode):
     def appStarted(mode):
-        mode.leaderboardTxt = readFile('Leaderboard.txt')
         mode.homeImage = mode.loadImage('Home.png')
         mode.homeBounds = (mode.width*(6.5/16), mode.height*(13.2/16),
                             mode.width*(9.5/16), mode.height*(14.8/16))
@@ -445,7 +419,7 @@ class LeaderboardMode(Mode):
         mode.drawLeaderboard(canvas)
 
         canvas.create_image(mode.width/2, mode.height * (14/16),
-            image=ImageTk.PhotoImage(mode.homeImage))
+            pilImage=mode.homeImage)
         hx0, hy0, hx1, hy1 = mode.homeBounds
         canvas.create_rectangle(hx0, hy0, hx1, hy1, outline=mode.getColor(button='home'))
     
@@ -465,24 +439,7 @@ class LeaderboardMode(Mode):
             return neonBlue
 
     def drawLeaderboard(mode, canvas):
-        s = ''
-        leaderboardList = mode.leaderboardTxt.strip().splitlines()
-        for i in range(min(len(leaderboardList), 9)):
-            data = leaderboardList[i]
-            formattedScore = ''
-            hitNumber = False
-            for c in data:
-                if c.isalpha():
-                    formattedScore += c
-                elif c.isnumeric():
-                    while len(formattedScore) < 10:
-                        formattedScore += ' '
-                    if not hitNumber:
-                        formattedScore += '\t\t'
-                        hitNumber = True
-
-                    formattedScore += c 
-            s += f'{i+1}.  {formattedScore}\n'
+        s = getLeaderboardText(mode.app.leaderboard, 9)
         font= 'system 30 roman'
         color = '#edff00'
         canvas.create_text(mode.width * (8/16), mode.height* (2.5/16), font=font, fill=color,
@@ -533,7 +490,6 @@ class SplashScreenMode(Mode):
         if ( (px0 <= x <= px1) and (py0 <= y <= py1)):
             mode.app.setActiveMode(mode.app.roundWonMode)
         elif ( (lx0 <= x <= lx1) and (ly0 <= y <= ly1) ):
-            mode.app.leaderboardMode.leaderboardTxt = readFile('Leaderboard.txt')
             mode.app.setActiveMode(mode.app.leaderboardMode)
         elif ( (cx0 <= x <= cx1) and (cy0 <= y <= cy1) ):
             mode.app.setActiveMode(mode.app.calibrationMode)
@@ -568,22 +524,22 @@ class SplashScreenMode(Mode):
     def redrawAll(mode, canvas):
         canvas.create_rectangle(0, 0, mode.width, mode.height, fill='black')
         canvas.create_image(mode.width/2, mode.height * (4/16), 
-            image=ImageTk.PhotoImage(mode.titleImage))
+            pilImage=mode.titleImage)
         textTab = 300
         canvas.create_image(mode.width/2 - textTab, mode.height * (8/16), 
-            image=ImageTk.PhotoImage(mode.playImage), anchor = 'w')
+            pilImage=mode.playImage, anchor = 'w')
         x0, y0, x1, y1 = mode.playBounds
         canvas.create_rectangle(x0, y0, x1, y1, outline=mode.getColor(button='play'))
         canvas.create_image(mode.width/2 - textTab, mode.height * (10/16), 
-            image=ImageTk.PhotoImage(mode.calibrateImage), anchor = 'w')
+            pilImage=mode.calibrateImage, anchor = 'w')
         x0, y0, x1, y1 = mode.calibrationBounds
         canvas.create_rectangle(x0, y0, x1, y1, outline=mode.getColor(button='calibrate'))
         canvas.create_image(mode.width/2 - textTab, mode.height * (12/16), 
-            image=ImageTk.PhotoImage(mode.leaderboardImage), anchor = 'w')
+            pilImage=mode.leaderboardImage, anchor = 'w')
         x0, y0, x1, y1 = mode.leaderboardBounds
         canvas.create_rectangle(x0, y0, x1, y1, outline=mode.getColor(button='leaderboard'))
         canvas.create_image(mode.width/2 - textTab - 20, mode.height * (14/16), 
-            image=ImageTk.PhotoImage(mode.quitImage), anchor = 'w')
+            pilImage=mode.quitImage, anchor = 'w')
         qx0, qy0, qx1, qy1 = mode.quitBounds
         canvas.create_rectangle(qx0, qy0, qx1, qy1, outline=mode.getColor(button='quit'))
         
@@ -597,9 +553,20 @@ class GameMode(Mode):
         mode.dmarg = 50
         mode.distance = 1000
 
-        mode.player = Player(mode)
-        mode.ball = Ball(mode)
-        mode.opponent = Opponent(mode)
+        ## every 3D point in the game, projected together in projectAll ##
+        mode.scene = SceneBuffer()
+        ## except the arena, which only needs projecting again when the head moves ##
+        mode.arena = SceneBuffer()
+        mode.arenaProjection = ProjectionCache(mode.arena, threshold=2)
+
+        ## the rules run in the engine, this mode just feeds it the paddle and draws it ##
+        mode.engine = Engine(mode.width, mode.height, mode.depth, mode.dmarg,
+                             recordInputs=(mode.app.recordInputs != None))
+        mode.playerBox = SceneObject(mode.scene)
+        mode.opponentBox = SceneObject(mode.scene)
+        mode.ballBox = SceneObject(mode.scene)
+        ## two rows per ball when there's a MultiballEngine, see setBalls ##
+        mode.multiballBoxes = None
 
         mode.paddleX = mode.width/2
         mode.paddleY = mode.height/2
@@ -609,16 +576,18 @@ class GameMode(Mode):
 
         mode.background = [ ]
         mode.ballLines = [ ]
-        mode.ballTrail = [ ]
-        mode.playerScore = 0
-        mode.opponentScore = 0
         mode.initBackground()
-        mode.initBall()
+        ## the ball's last few positions, brightest at the ball ##
+        app = mode.app
+        mode.ballTrail = Trail(mode.scene, app.trailLength, app.trailFade)
+        mode.trailColors = [ f'#{int(255 * (i + 1)/app.trailFade):02x}0000'
+                             for i in range(app.trailFade) ]
+        mode.trailServe = None # engine.serves when the trail was started
+        mode.initBallLines()
 
         mode.startCountdown = False
         mode.paused = False
         mode.timerCounter = -1
-        mode.numberImage = mode.loadImage('NumbersRed.png')
         mode.resumingImage = mode.scaleImage(mode.loadImage('ResumingRed.png'), .8)
         mode.pausedImage = mode.loadImage('Paused.png')
         mode.numberDisplay = None
@@ -627,14 +596,37 @@ class GameMode(Mode):
 
         mode.mouseMode = False
         mode.app.score = 0
+
+        ## physics runs in fixed steps of real time, however fast we tick ##
+        mode.clock = PhysicsClock(stepTime=1/30, maxSubsteps=4)
+
+    def modeActivated(mode):
+        ## don't make up for the time spent in other modes ##
+        mode.clock.reset()
+
+    def modeDeactivated(mode):
+        if mode.app.recordInputs != None:
+            mode.engine.saveInputs(mode.app.recordInputs)
     
     
     def initBall(mode):
-        x = random.randint(-20, 20)
-        y = random.randint(-20, 20)
-        z = -80
-        mode.ball = Ball(mode, vx=x, vy=y, vz=z)
-        ## ball lines ##
+        mode.engine.serve()
+
+    def setBalls(mode, balls):
+        ## swaps in an engine with this many balls, keeping the opponent's level ##
+        old = mode.engine
+        if balls > 1:
+            mode.engine = MultiballEngine(mode.width, mode.height, mode.depth, mode.dmarg, balls=balls)
+            mode.multiballBoxes = SceneObject(mode.scene, rows=2*balls)
+        else:
+            mode.engine = Engine(mode.width, mode.height, mode.depth, mode.dmarg)
+            mode.multiballBoxes = None
+        mode.engine.opponent.level = old.opponent.level
+        mode.engine.inputs = old.inputs
+        mode.ballTrail.clear()
+
+    def initBallLines(mode):
+        ## ball lines, at the ball's depth (see projectAll) ##
         mode.ballLines = [ ]
         mode.ballLines.append(Background(mode, (0, 0, 0), (1000, 0, 0)))
         mode.ballLines.append(Background(mode, (0, 0, 0), (0, 800, 0)))
@@ -646,52 +638,86 @@ class GameMode(Mode):
         ## depth lines ##
         depth = mode.depth
         dmarg = mode.dmarg
-        mode.background.append(Background(mode, (0, 0, 0+dmarg), (0, 0, depth+dmarg)))
-        mode.background.append(Background(mode, (1000, 0, 0+dmarg), (1000, 0, depth+dmarg)))
-        mode.background.append(Background(mode, (0, 800, 0+dmarg), (0, 800, depth+dmarg)))
-        mode.background.append(Background(mode, (1000, 800, 0+dmarg), (1000, 800, depth+dmarg)))
+        arena = mode.arena
+        mode.background.append(Background(mode, (0, 0, 0+dmarg), (0, 0, depth+dmarg), arena))
+        mode.background.append(Background(mode, (1000, 0, 0+dmarg), (1000, 0, depth+dmarg), arena))
+        mode.background.append(Background(mode, (0, 800, 0+dmarg), (0, 800, depth+dmarg), arena))
+        mode.background.append(Background(mode, (1000, 800, 0+dmarg), (1000, 800, depth+dmarg), arena))
 
         ## x-y slices
         for n in range(0, 6):
-            mode.background.append(Background(mode, (0, 0, n*depth/5+dmarg), (1000, 0, n*depth/5+dmarg)))
-            mode.background.append(Background(mode, (0, 0, n*depth/5+dmarg), (0, 800, n*depth/5+dmarg)))
-            mode.background.append(Background(mode, (1000, 0, n*depth/5+dmarg), (1000, 800, n*depth/5+dmarg)))
-            mode.background.append(Background(mode, (0, 800, n*depth/5+dmarg), (1000, 800, n*depth/5+dmarg)))
+            mode.background.append(Background(mode, (0, 0, n*depth/5+dmarg), (1000, 0, n*depth/5+dmarg), arena))
+            mode.background.append(Background(mode, (0, 0, n*depth/5+dmarg), (0, 800, n*depth/5+dmarg), arena))
+            mode.background.append(Background(mode, (1000, 0, n*depth/5+dmarg), (1000, 800, n*depth/5+dmarg), arena))
+            mode.background.append(Background(mode, (0, 800, n*depth/5+dmarg), (1000, 800, n*depth/5+dmarg), arena))
 
     def timerFired(mode):
         mode.app.time += 1
-        mode.app.processImage()
+        ## the paddle matters mid-rally, the head while we're waiting to play ##
+        if mode.startCountdown or mode.paused:
+            mode.app.visionPriority = 'face'
+        else:
+            mode.app.visionPriority = 'paddle'
+        with mode.app.timed('vision'):
+            mode.app.processImage()
         mode.faceX = int((mode.app.faceX - 150) * (1000/850))
         ## should range from 0 to 1000
         mode.faceY = int((mode.app.faceY - 176) * (800/569))
-        mode.projectAll()
-        if mode.startCountdown == True:
-            mode.updateCountdown()
-            return
-        if mode.paused:
+        if mode.startCountdown or mode.paused:
+            mode.clock.reset()
+            with mode.app.timed('projection'):
+                mode.projectAll()
+            if mode.startCountdown == True:
+                mode.updateCountdown()
             return
-        mode.updatePlayer(mode.player)
-        mode.updateBackground()
-        mode.updateBall(mode.ball)
-        mode.updateOpponent(mode.opponent)
+        with mode.app.timed('physics'):
+            mode.clock.tick(time.perf_counter())
+            mode.updatePlayer(mode.engine.player, mode.clock.getPendingSteps())
+            ## the end of a round resets the clock, which ends the loop ##
+            while mode.clock.consume():
+                mode.updateBackground()
+                mode.engine.step()
+                if mode.multiballBoxes == None:
+                    mode.makeBallTrail(mode.engine.ball)
+                for outcome in mode.engine.outcomes:
+                    mode.doScore(outcome)
+                    if outcome in ('roundWon', 'roundLost'):
+                        break
+        with mode.app.timed('projection'):
+            mode.projectAll()
         if mode.timerCounter == -1:
             mode.timerCounter += 1
             mode.startCountdown = True
-        cv.imshow('frame', mode.app.frame)
+        with mode.app.timed('imshow'):
+            cv.imshow('frame', mode.app.frame)
 
     def projectAll(mode):
-        ball = mode.ball
-        opponent =  mode.opponent
-        player = mode.player
-        ball.project(mode)
+        ## lines keep their points in mode.scene already, the boxes move ##
+        ## the ball and opponent are drawn between their last two physics steps ##
+        engine = mode.engine
+        alpha = mode.clock.alpha
+        if mode.multiballBoxes != None:
+            ## all the balls' corners in two slice assignments ##
+            positions = engine.getPositions(alpha)
+            r, row, n = engine.r, mode.multiballBoxes.row, len(positions)
+            mode.scene.points[row:row + 2*n:2] = positions - (r, r, 0)
+            mode.scene.points[row + 1:row + 2*n:2] = positions + (r, r, 0)
+            x, y, z = engine.getIncoming()
+        else:
+            x, y, z = engine.ball.getPosition(alpha)
+            r = engine.ball.r
+            mode.ballBox.setPoints( (x - r, y - r, z), (x + r, y + r, z) )
         for line in mode.ballLines:
-            line.project(mode)
-        for line in mode.ballTrail:
-            line.project(mode)
-        opponent.project(mode)
-        player.project(mode)
-        for line in mode.background:
-            line.project(mode)
+            line.setDepth(z)
+        opponent = engine.opponent
+        x, y = opponent.getPosition(alpha)
+        mode.opponentBox.setPoints( (x - opponent.width/2, y - opponent.height/2, opponent.z),
+                                    (x + opponent.width/2, y + opponent.height/2, opponent.z) )
+        player = engine.player
+        mode.playerBox.setPoints( (player.x - player.width/2, player.y - player.height/2, player.z),
+                                  (player.x + player.width/2, player.y + player.height/2, player.z) )
+        mode.scene.project(mode.faceX, mode.faceY, mode.distance)
+        mode.arenaProjection.project(mode.faceX, mode.faceY, mode.distance)
 
 
     def updateCountdown(mode):
@@ -709,139 +735,64 @@ class GameMode(Mode):
             mode.timerCounter = 0
     
     def getNumberImage(mode, n):
-        k = 0
-        digitImage = mode.numberImage.crop( (0, k + 240*n, 200, k + 240*(n+1)) )
-        digitImage = mode.scaleImage(digitImage, .8)
-        return digitImage
+        return mode.app.digitAtlas.getDigit(n, .8)
 
-    def updatePlayer(mode, player):
+    def updatePlayer(mode, player, steps=1):
         if not mode.mouseMode:
-            player.x = mode.app.paddleX * (3/4)
-            if player.x > mode.width - player.width/2:
-                player.x = mode.width - player.width/2
-            elif player.x < player.width/2:
-                player.x = player.width/2
-            player.y = (mode.app.paddleY - 150) * (5/4)
-            if player.y > mode.height - player.height/2:
-                player.y = mode.height - player.height/2
-            elif player.y < player.height/2:
-                player.y = player.height/2
+            mode.engine.movePlayer(mode.app.paddleX * (3/4), (mode.app.paddleY - 150) * (5/4))
         ## should range from 0 to 800
          #mode.app.headSize * 10
         mode.headSize = mode.app.headSize
-        player.updateVelocity()
+        ## velocity is per physics step, so spread the move over this tick's steps ##
+        if steps > 0:
+            player.updateVelocity(steps)
 
     def mouseMoved(mode, event):
-        player = mode.player
+        player = mode.engine.player
         if mode.mouseMode:
             player.x, player.y = event.x, event.y
 
-    def updateOpponent(mode, opponent):
-        (vx, vy) = opponent.getVelocity(mode)
-        opponent.x += vx
-        if opponent.x > mode.width - opponent.width/2:
-            opponent.x = mode.width - opponent.width/2
-        elif opponent.x < opponent.width/2:
-            opponent.x = opponent.width/2
-        opponent.y += vy
-        if opponent.y > mode.height - opponent.height/2:
-            opponent.y = mode.height - opponent.height/2
-        elif opponent.y < opponent.height/2:
-            opponent.y = opponent.height/2
-    
     def updateBackground(mode):
         pass
 
-    def updateBall(mode, ball):
-        ball.doMove(mode)
-        ball.checkContact(mode)
-        mode.makeBallTrail(ball)
-
-
-    def applySpin(mode, player = False, opponent = False):
-        ## net velocity is viewed from the ball's frame
-        ## Positive net velocity is if the ball has no spin, no vx, and player vx is positive
-        ## spinX is thetawise viewed from the top of the box
-        ## spinY is thetawise from the right of the box
-        ball = mode.ball
-        player = mode.player
-        opponent = mode.opponent
-        if player:
-            netVx = player.vx - ball.spinX - ball.vx
-            netVy = player.vy - ball.spinY - ball.vy
-        elif opponent:
-            netVx = ball.vx - ball.spinX - opponent.vx
-            netVy = opponent.vy - ball.spinY - ball.vy
-        else:
-            pass
-        k = .05
-        ball.spinX = k * netVx
-        ball.spinY = k * netVy
-
-    def doScore(mode, player = False, opponent = False):
-        if player:
-            mode.playerScore += 1
+    def doScore(mode, outcome):
+        ## the engine keeps the score, the app keeps the points and the level ##
+        if outcome in ('player', 'roundWon'):
             mode.app.score += 10
-        elif opponent:
-            mode.opponentScore += 1
-        if mode.playerScore == 3:
-            mode.playerScore = 0
-            mode.opponentScore = 0
-            mode.opponent.level += 1
-            mode.timerCounter = -1
-            mode.firstStart = True
-            mode.ball.prevPositions = [ ]
-            mode.ballTrail = [ ]
+        if outcome == 'roundWon':
+            mode.endRound(won=True)
+        elif outcome == 'roundLost':
+            mode.endRound(won=False)
+
+    def endRound(mode, won):
+        mode.timerCounter = -1
+        mode.firstStart = True
+        mode.ballTrail.clear()
+        mode.clock.reset()
+        if won:
             mode.app.level += 1
             mode.app.setActiveMode(mode.app.roundWonMode)
-        if mode.opponentScore == 3:
-            mode.playerScore = 0
-            mode.opponentScore = 0
-            mode.opponent.level = 0
-            mode.firstStart = True
-            mode.timerCounter = -1
-            mode.ball.prevPositions = [ ]
-            mode.ballTrail = [ ]
+        else:
             mode.app.setActiveMode(mode.app.gameOverMode)
-        mode.initBall()
 
     def makeBallTrail(mode, ball):
-        ballPos = (ball.x, ball.y, ball.z)
-        ball.prevPositions.append(ballPos)
-        if len(ball.prevPositions) >= 6:
-            ball.prevPositions.pop(0)
-        if len(ball.prevPositions) >= 2:
-            start = ball.prevPositions[-2]
-            end = ball.prevPositions[-1]
-            ballLine = Background(mode, start, end)
-            mode.ballTrail.append(ballLine)
-            if len(mode.ballTrail) >= 6:
-                mode.ballTrail.pop(0)
+        ## a new serve starts a new trail ##
+        if mode.trailServe != mode.engine.serves:
+            mode.trailServe = mode.engine.serves
+            mode.ballTrail.clear()
+        mode.ballTrail.add( (ball.x, ball.y, ball.z) )
 
     def keyPressed(mode, event):
         if event.key == 'c':
             mode.app.setActiveMode(mode.app.calibrationMode)
         elif event.key == 'w':
-            mode.playerScore = 0
-            mode.opponentScore = 0
-            mode.opponent.level += 1
-            mode.timerCounter = -1
-            mode.firstStart = True
-            mode.ball.prevPositions = [ ]
-            mode.ballTrail = [ ]
-            mode.app.level += 1
-            mode.app.setActiveMode(mode.app.roundWonMode)
+            mode.engine.endRound(won=True)
+            mode.endRound(won=True)
         elif event.key == 's':
             mode.app.score += 10
         elif event.key == 'l':
-            mode.playerScore = 0
-            mode.opponentScore = 0
-            mode.opponent.level = 0
-            mode.firstStart = True
-            mode.timerCounter = -1
-            mode.ball.prevPositions = [ ]
-            mode.ballTrail = [ ]
-            mode.app.setActiveMode(mode.app.gameOverMode)
+            mode.engine.endRound(won=False)
+            mode.endRound(won=False)
         elif event.key == 'r':
             mode.initBall()
         elif event.key == 'Space':
@@ -856,6 +807,15 @@ class GameMode(Mode):
                 mode.mouseMode = False
             else:
                 mode.mouseMode = True
+        elif event.key == 'v':
+            print(mode.app.visionStats)
+        elif event.key == 'p':
+            print(mode.arenaProjection.getStats())
+        elif event.key == 'b':
+            if mode.multiballBoxes == None:
+                mode.setBalls(5)
+            else:
+                mode.setBalls(1)
 
     def redrawAll(mode, canvas):
         mode.drawBackground(canvas)
@@ -863,250 +823,156 @@ class GameMode(Mode):
         mode.drawBall(canvas)
         mode.drawPlayer(canvas)
         if mode.paused:
-            canvas.create_image(mode.width/2, mode.height*(6/16), image=ImageTk.PhotoImage(mode.pausedImage))
+            canvas.create_image(mode.width/2, mode.height*(6/16), pilImage=mode.pausedImage)
         if mode.startCountdown:
             mode.drawStartCounter(canvas)
 
     def drawStartCounter(mode, canvas):
         if mode.firstStart:
-            image = ImageTk.PhotoImage(mode.startingInImage)
+            image = mode.startingInImage
         else:
-            image=ImageTk.PhotoImage(mode.resumingImage)
-        canvas.create_image(mode.width/2, mode.height * (6/16), image=image)
+            image = mode.resumingImage
+        canvas.create_image(mode.width/2, mode.height * (6/16), pilImage=image)
         if mode.numberDisplay != None:
-            canvas.create_image(mode.width/2, mode.height * (9/16), image=ImageTk.PhotoImage(mode.numberDisplay))
+            canvas.create_image(mode.width/2, mode.height * (9/16), pilImage=mode.numberDisplay)
 
 
+    ## the arena is drawn with retained canvas items: each key keeps its item
+    ## between frames and only has its coords/options updated ##
     def drawBackground(mode, canvas):
-        canvas.create_rectangle(0, 0, mode.width, mode.height, fill='black')
-        for line in mode.background:
+        canvas.retain_rectangle('arena', 0, 0, mode.width, mode.height, fill='black')
+        for i in range(len(mode.background)):
+            line = mode.background[i]
             x0, y0 = line.projectedStart
             x1, y1 = line.projectedEnd
             color = '#00ffff'
-            canvas.create_line(x0, y0, x1, y1, width=2, fill=color)
-        for line in mode.ballLines:
-            x0, y0 = line.projectedStart
-            x1, y1 = line.projectedEnd
-            canvas.create_line(x0, y0, x1, y1, width=2, fill='green')
-        for line in mode.ballTrail:
+            canvas.retain_line(('background', i), x0, y0, x1, y1, width=2, fill=color)
+        for i in range(len(mode.ballLines)):
+            line = mode.ballLines[i]
             x0, y0 = line.projectedStart
             x1, y1 = line.projectedEnd
-            canvas.create_line(x0, y0, x1, y1, width=1, fill='red')
+            canvas.retain_line(('ballLine', i), x0, y0, x1, y1, width=2, fill='green')
+        ## one polyline per fade band ##
+        bands = mode.ballTrail.getBands()
+        colors = mode.trailColors[len(mode.trailColors) - len(bands):]
+        for i in range(len(bands)):
+            canvas.retain_line(('trail', i), bands[i], width=1, fill=colors[i])
     
     def drawPlayer(mode, canvas):
-        x0, y0 = mode.player.projectedStart
-        x1, y1 = mode.player.projectedEnd
+        x0, y0 = mode.playerBox.projectedStart
+        x1, y1 = mode.playerBox.projectedEnd
         cx = (x0 + x1)/2
         cy = (y0 + y1)/2
         font = 'system 36 roman'
         color = '#0080ff'
-        canvas.create_rectangle(x0, y0, x1, y1, width=7, outline=color)
-        canvas.create_text(cx, cy, text=f'{mode.playerScore}', fill=color, font=font)
+        canvas.retain_rectangle('player', x0, y0, x1, y1, width=7, outline=color)
+        canvas.retain_text('playerScore', cx, cy, text=f'{mode.engine.playerScore}', fill=color, font=font)
 
     def drawOpponent(mode, canvas):
-        x0, y0 = mode.opponent.projectedStart
-        x1, y1 = mode.opponent.projectedEnd
+        x0, y0 = mode.opponentBox.projectedStart
+        x1, y1 = mode.opponentBox.projectedEnd
         cx = (x0 + x1)/2
         cy = (y0 + y1)/2
         font = 'system 20 roman'
         color = '#e50000'
-        canvas.create_rectangle(x0, y0, x1, y1, width=3, outline=color)
-        canvas.create_text(cx, cy, text=f'{mode.opponentScore}', fill=color, font=font)
+        canvas.retain_rectangle('opponent', x0, y0, x1, y1, width=3, outline=color)
+        canvas.retain_text('opponentScore', cx, cy, text=f'{mode.engine.opponentScore}', fill=color, font=font)
 
     def drawBall(mode, canvas):
-        for (x0, y0, x1, y1) in mode.ball.projections:
-            color = '#00cd00'
-            canvas.create_oval(x0, y0, x1, y1, width=5, outline=color)
-
-    def getProjections(mode, t1, t2):
-        # feed t1 and t2 3D coords
-        x0, y0, z0 = t1
-        x1, y1, z1 = t2
-
-        d = mode.distance
-        fx = mode.faceX
-        fy = mode.faceY
-
-        projX0 = fx + (d/(d+z0)) * (x0 - fx)
-        projX1 = fx + (d/(d+z1)) * (x1 - fx)
-        
-        projY0 = fy + (d/(d+z0)) * (y0 - fy)
-        projY1 = fy + (d/(d+z1)) * (y1 - fy)
-
-        return (projX0, projY0, projX1, projY1)
-
-class Player(object):
-    def __init__(self, mode):
-        self.x = mode.width/2
-        self.y = mode.height/2
-        self.z = mode.dmarg
-        self.width = 300
-        self.height = 200
-        self.lastPos = (mode.width/2, mode.height/2)
-        self.vx = 0
-        self.vy = 0
-        self.projectedStart = (0, 0)
-        self.projectedEnd = (0, 0)
-
-    def updateVelocity(self):
-        currX, currY = self.x, self.y
-        lastX, lastY = self.lastPos
-        self.vx = currX - lastX
-        self.vy = currY - lastY
-        self.lastPos = (currX, currY)
-
-    def project(self, mode):
-        x0, y0, z0 = self.x - self.width/2, self.y - self.height/2, self.z
-        x1, y1, z1 = self.x + self.width/2, self.y + self.height/2, self.z
-
-        projX0, projY0, projX1, projY1 = mode.getProjections((x0, y0, z0), (x1, y1, z1))
-
-        self.projectedStart = (projX0, projY0)
-        self.projectedEnd = (projX1, projY1)
-
-    
-
-class Opponent(object):
-    def __init__(self, mode):
-        self.x = mode.width/2
-        self.y = mode.height/2
-        self.z = mode.depth
-        self.width = 300
-        self.height = 200
-        self.level = 0
-        self.projectedStart = (0, 0)
-        self.projectedEnd = (0, 0)
-
-    def getVelocity(self, mode):
-        ball = mode.ball
-        vectorX = ball.x - self.x
-        vectorY = ball.y - self.y
-        norm = (vectorX**2 + vectorY**2)**0.5
-        if norm == 0:
-            dx, dy = 0, 0
-        else:
-            dx, dy = vectorX/norm, vectorY/norm
-        k = 5
-        maxSpeed = 20 + k * self.level
-        speed = min(maxSpeed, norm)
-        velocity = (speed * dx, speed * dy)
-        return velocity
-
-
-    def project(self, mode):
-        x0, y0, z0 = self.x - self.width/2, self.y - self.height/2, self.z
-        x1, y1, z1 = self.x + self.width/2, self.y + self.height/2, self.z
-
-        projX0, projY0, projX1, projY1 = mode.getProjections((x0, y0, z0), (x1, y1, z1))
-
-        self.projectedStart = (projX0, projY0)
-        self.projectedEnd = (projX1, projY1)
-
-
-class Ball(object):
-    def __init__(self, mode, vx=10, vy=20, vz=-70):
-        self.r = 40
-        self.x = mode.width/2
-        self.y = mode.height/2
-        self.z = mode.depth * (7/8)
-        self.vx = vx
-        self.vy = vy
-        self.vz = vz
-        self.spinX = 0
-        self.spinY = 0
-        self.projections = [ (0,0,0,0), (0,0,0,0), (0,0,0,0) ]
-        self.prevPositions = [ ]
-
-    def project(self, mode):
-        #XY
-        x0, y0, z0 = self.x - self.r, self.y - self.r, self.z
-        x1, y1, z1 = self.x + self.r, self.y + self.r, self.z
-        self.projections[0] = mode.getProjections( (x0,y0,z0), (x1,y1,z1))
-
-    def checkContact(self, mode):
-        dmarg = mode.dmarg
-        ## Player ##
-        player = mode.player
-        px0, px1 = player.x - player.width/2, player.x + player.width/2
-        py0, py1 = player.y - player.height/2, player.y + player.height/2
-        ## Opponent ##
-        opponent = mode.opponent
-        ox0, ox1 = opponent.x - opponent.width/2, opponent.x + opponent.width/2
-        oy0, oy1 = opponent.y - opponent.height/2, opponent.y + opponent.height/2
-        xMin, xMax = self.x - self.r, self.x + self.r
-        yMin, yMax = self.y - self.r, self.y + self.r
-        zMin, zMax = self.z - self.r, self.z + self.r
-        if xMin <= 0:
-            self.vx *= -1
-            self.x = self.r
-        elif xMax >= mode.width:
-            self.vx *= -1
-            self.x = mode.width - self.r
-        if yMin <= 0:
-            self.vy *= -1
-            self.y = self.r 
-        elif yMax >= mode.height:
-            self.vy *= -1
-            self.y = mode.height - self.r
-        if (zMax >= mode.depth):
-            if ( (ox0 <= self.x <= ox1)
-                and (oy0 <= self.y <= oy1) ):
-                self.vz *= -1.05
-                self.z = mode.depth - self.r
-                mode.applySpin(opponent = True)
-            else:
-                mode.doScore(player = True)
-        elif (zMin <= dmarg):
-            if ( (px0 - 0.5*self.r <= self.x <= px1 + 0.5*self.r)
-                and (py0 - 0.5*self.r <= self.y <= py1 + 0.5*self.r) ):
-                self.vz *= -1
-                self.z = self.r + dmarg
-                mode.applySpin(player = True)
-            else:
-                mode.doScore(opponent = True)
-
-    
-    def doMove(self, mode):
-        self.x += self.vx
-        self.y += self.vy
-        self.z += self.vz
-        self.vx -= self.spinX
-        self.vy -= self.spinY
-        for line in mode.ballLines:
-            x0, y0, z0 = line.start
-            x1, y1, z1 = line.end
-
-            line.start = (x0, y0, self.z)
-            line.end = (x1, y1, self.z)
-        
-
-    def __repr__(self):
-        return f'Ball: {self.projectedStart}, {self.projectedEnd}'
-
-class Background(object):
-    def __init__(self, mode, start, end):
-        self.start = start
-        self.end = end
-        ## tuples of (x, y, z) ##
-        self.projectedStart = (0, 0)
-        self.projectedEnd = (0, 0)
-        ## tuples of (x, y) ##
-
-    def project(self, mode):
-        x0, y0, z0 = self.start
-        x1, y1, z1 = self.end
-
-        projX0, projY0, projX1, projY1 = mode.getProjections((x0, y0, z0), (x1, y1, z1))
-
-        self.projectedStart = (projX0, projY0)
-        self.projectedEnd = (projX1, projY1)
-
-    def __repr__(self):
-        return f'Line: {self.projectedStart}, {self.projectedEnd}'
+        color = '#00cd00'
+        if mode.multiballBoxes != None:
+            ## one read of every ball's projected box ##
+            row, n = mode.multiballBoxes.row, len(mode.engine.pos)
+            boxes = mode.scene.projected[row:row + 2*n].reshape(n, 4).tolist()
+            for i in range(n):
+                x0, y0, x1, y1 = boxes[i]
+                canvas.retain_oval(('ball', i), x0, y0, x1, y1, width=5, outline=color)
+            return
+        x0, y0 = mode.ballBox.projectedStart
+        x1, y1 = mode.ballBox.projectedEnd
+        canvas.retain_oval('ball', x0, y0, x1, y1, width=5, outline=color)
+
+class Background(SceneObject):
+    __slots__ = ( )
+
+    def __init__(self, mode, start, end, scene=None):
+        ## lines go in mode.scene unless another SceneBuffer is given ##
+        super().__init__(scene if scene != None else mode.scene)
+        self.setPoints(start, end)
+        ## start, end are (x, y, z), projectedStart/End are (x, y) views of mode.scene ##
+
+    @property
+    def start(self):
+        return tuple(self.scene.points[self.row].tolist())
+
+    @start.setter
+    def start(self, point):
+        self.scene.points[self.row] = point
+
+    @property
+    def end(self):
+        return tuple(self.scene.points[self.row + 1].tolist())
+
+    @end.setter
+    def end(self, point):
+        self.scene.points[self.row + 1] = point
+
+    def setDepth(self, z):
+        self.scene.points[self.row:self.row + 2, 2] = z
+
+class DigitAtlas(object):
+    # NumbersRed.png is a strip of the digits 0-9 stacked top to bottom. Each
+    # digit is cropped once, and scaled once per size it is drawn at, so the
+    # redraws only ever reuse the same images (which also keeps them in the
+    # canvas' PhotoImage cache).
+    def __init__(self, image, scales=(1,), digitWidth=200):
+        self.cellHeight = image.height/10
+        self.digits = [ image.crop( (0, self.cellHeight*n, digitWidth, self.cellHeight*(n+1)) )
+                        for n in range(10) ]
+        self.sprites = dict() # maps (digit, scale) to an image
+        for scale in scales:
+            for n in range(10):
+                self.getDigit(n, scale)
+
+    def getDigit(self, n, scale=1):
+        key = (n, scale)
+        if key not in self.sprites:
+            digit = self.digits[n]
+            self.sprites[key] = digit.resize( (round(digit.width*scale), round(digit.height*scale)),
+                                              resample=Image.NEAREST )
+        return self.sprites[key]
+
+    def getNumber(self, n, scale=1):
+        # the sprites for each digit of n, most significant first
+        return [ self.getDigit(int(digit), scale) for digit in str(n) ]
+
+    def drawNumber(self, canvas, n, x, y, scale=1, spacing=None):
+        # the first digit is centered on (x, y), the rest follow every spacing
+        sprites = self.getNumber(n, scale)
+        if spacing == None:
+            spacing = sprites[0].width
+        for i in range(len(sprites)):
+            canvas.create_image(x + i*spacing, y, pilImage=sprites[i])
 
 
 class TermProjectDemo(ModalApp):
+    def __init__(app, source=0, record=None, recordInputs=None, trailLength=6, trailFade=3,
+                 **kwargs):
+        ## camera index, video file or directory of frames, see Camera.py ##
+        app.source = source
+        app.record = record
+        ## file to save the paddle's position at every physics step to, see Engine.py ##
+        app.recordInputs = recordInputs
+        ## positions in the ball's trail, and how many steps it fades in ##
+        app.trailLength = trailLength
+        app.trailFade = trailFade
+        super().__init__(**kwargs)
+
     def appStarted(app):
+        ## shared by the modes below, the countdown at .8 and the round number at .5 ##
+        app.digitAtlas = DigitAtlas(app.loadImage('NumbersRed.png'), scales=(.8, .5))
+        ## read once, GameOverMode adds to it and LeaderboardMode shows it ##
+        app.leaderboard = Leaderboard.load('Leaderboard.txt')
         app.gameMode = GameMode()
         app.calibrationMode = CalibrationMode()
         app.splashScreenMode = SplashScreenMode()
@@ -1120,13 +986,22 @@ class TermProjectDemo(ModalApp):
 
         app.timerDelay = 1
 
-        app.cap = cv.VideoCapture(0)
-        app.face_cascade = cv.CascadeClassifier('haarcascade_frontalface_default.xml')
+        app.cap = openFrameSource(app.source, fps='native', loop=True)
+        if app.record != None:
+            app.cap.recorder = FrameRecorder(app.record, fps=app.cap.getNativeFps())
+        app.cap.start()
         app.success, app.frame = app.cap.read()
-        app.gray = None
-        app.mask = None
+        app.frameSeq = 0
+        app.frameTime = None
         app.tracker = None
-        app.result = None
+
+        ## run the OpenCV chain in a second process when we can ##
+        app.vision = VisionPipeline()
+        app.visionProcess = None
+        app.visionPriority = 'paddle'
+        app.visionStats = None
+        if app.success and shared_memory != None:
+            app.visionProcess = VisionProcess(app.frame.shape)
 
         '''
         cv.namedWindow('sliders')
@@ -1139,6 +1014,7 @@ class TermProjectDemo(ModalApp):
         '''
 
         app.hsvBounds = (0, 255, 0, 255, 0, 255)
+        app.colorModel = None
 
         app.paddleX = app.width/2
         app.paddleY = app.height/2
@@ -1151,104 +1027,96 @@ class TermProjectDemo(ModalApp):
 
         app.time = 0
 
+    def appStopped(app):
+        super().appStopped()
+        app.cap.release()
+        if app.visionProcess != None:
+            app.visionProcess.close()
 
     def processImage(app):
         #if app.time % 10 != 0:
         #   return
-        success, frame = app.cap.read()
-        frame = cv.flip(frame, 1)
-
-        hsv = cv.cvtColor(frame, cv.COLOR_BGR2HSV)
-
-        '''
-        #SLIDER METHOD
-        l_h = cv.getTrackbarPos('L_Hue', 'sliders')
-        l_s = cv.getTrackbarPos('L_Saturation', 'sliders')
-        l_v = cv.getTrackbarPos('L_Value', 'sliders')
-
-        u_h = cv.getTrackbarPos('U_Hue', 'sliders')
-        u_s = cv.getTrackbarPos('U_Saturation', 'sliders')
-        u_v = cv.getTrackbarPos('U_Value', 'sliders')
-
-        l_c = np.array([l_h, l_s, l_v]) 
-        u_c = np.array([u_h, u_s, u_v]) 
-        '''
-
-        l_h, u_h, l_s, u_s, l_v, u_v = app.hsvBounds
-        l_c = np.array([l_h, l_s, l_v]) 
-        u_c = np.array([u_h, u_s, u_v]) 
-
-        '''
-        HARD CODED
-        l_c = np.array([58, 80, 25]) #hsv low of green
-        u_c = np.array([74, 232, 255]) #hsv high of green
-        '''
-
-        kernal = np.ones( (10, 10), np.uint8)
-
-        mask = cv.inRange(hsv, l_c, u_c)
-        app.mask = mask
-
-        tracker = cv.morphologyEx(mask, cv.MORPH_CLOSE, kernal, iterations=3)
-        app.tracker = tracker
-
-        result = cv.bitwise_and(frame, frame, mask=tracker)
-        app.result = result
-
-        gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
-        app.gray = gray
-        
-
-        contours, _ = cv.findContours(tracker, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-
-        if len(contours) != 0:
-            k = 2
-            xList = [ ]
-            yList = [ ]
-            for contour in contours:
-                if cv.contourArea(contour) < 40:
-                    continue
-                x, y, w, h = cv.boundingRect(contour)
-                xList.extend( [ x, x+w ] ) 
-                yList.extend( [ y, y+h ] )
-            if xList != [] and yList != []:
-                x0, y0, x1, y1 = min(xList), min(yList), max(xList), max(yList)
-                rectangle = (x0, y0, x1, y1)
-                cv.rectangle(frame, (x0,y0), (x1, y1), (0,255,0), 2)
-                app.paddleX, app.paddleY = k*(x0+x1)/2, k*(y0+y1)/2
-
-            app.frame = frame
+        ## grab whatever the capture thread has, never wait on the camera ##
+        seq, timestamp, frame = app.cap.getLatest()
+        if frame is None:
+            return
+        if app.visionProcess != None:
+            ## hand the frame to the worker and pick up whatever it has finished ##
+            app.visionProcess.update(hsvBounds=app.hsvBounds, colorModel=app.colorModel,
+                                     priority=app.visionPriority)
+            if seq != app.frameSeq and app.visionProcess.submit(frame, seq):
+                app.frameSeq, app.frameTime = seq, timestamp
+            result = app.visionProcess.poll()
+            if result == None:
+                return
+            seq, frame, tracker, values = result
+            app.visionStats = app.visionProcess.stats
         else:
-            None
-
-        faces = app.face_cascade.detectMultiScale( gray, 1.1, 4)
-
-        primaryFace = app.getLargestFace(faces)
-        if isinstance(primaryFace, np.ndarray):
-            (x, y, w, h) = primaryFace
-
-            cv.rectangle(frame, (x,y), (x+w, y+h), (0,0,255), 2)
-            k = 2
-            app.faceX, app.faceY = k*(x+w/2), k*(y+h/2)
+            if seq == app.frameSeq:
+                return
+            app.frameSeq, app.frameTime = seq, timestamp
+            app.vision.hsvBounds = app.hsvBounds
+            app.vision.colorModel = app.colorModel
+            app.vision.priority = app.visionPriority
+            frame, values = app.vision.process(frame)
+            tracker = app.vision.tracker
+            app.visionStats = app.vision.scheduler.getStats()
+
+        app.frame = frame
+        app.tracker = tracker
+        paddleX, paddleY, faceX, faceY, headSize = values
+        if paddleX != None:
+            app.paddleX, app.paddleY = paddleX, paddleY
+        if faceX != None:
+            app.faceX, app.faceY = faceX, faceY
+            app.headSize = headSize
 
-            app.frame = frame
-            app.headSize = h
+    def getResultImage(app):
+        # only the calibration debug window needs this, so build it on demand
+        return cv.bitwise_and(app.frame, app.frame, mask=app.tracker)
 
     def getLargestFace(app, faces):
-        largestArea = 0
-        largestFace = False
-        for face in faces:
-            (x, y, w, h) = face
-            area = w * h
-            if area > largestArea:
-                largestArea = area
-                largestFace = face
-        return largestFace
-
-TermProjectDemo(width=1000, height=800)
+        return getLargestFace(faces)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='VR Pong')
+    parser.add_argument('--source', default='0',
+        help='camera index, video file or directory of frames to play from')
+    parser.add_argument('--record', default=None,
+        help='save the camera feed to this video file (.avi/.mp4) or directory')
+    parser.add_argument('--instrument', action='store_true',
+        help='time every frame (control-t shows the overlay, control-d dumps it)')
+    parser.add_argument('--production', action='store_true',
+        help='skip the MVC checks and drawing-call logging')
+    parser.add_argument('--draw-log', default=False,
+        help='write every redraw\'s drawing calls to this file, one JSON line per frame')
+    parser.add_argument('--record-inputs', default=None,
+        help='save the paddle\'s path to this file, to replay with python Engine.py --inputs')
+    def atLeast(low):
+        # an argparse type for ints no smaller than low
+        def parse(text):
+            try:
+                value = int(text)
+            except ValueError:
+                raise argparse.ArgumentTypeError(f'{text!r} is not a whole number')
+            if value < low:
+                raise argparse.ArgumentTypeError(f'must be at least {low}, not {value}')
+            return value
+        return parse
+    parser.add_argument('--trail-length', type=atLeast(2), default=6,
+        help='physics steps of the ball\'s path to draw behind it')
+    parser.add_argument('--trail-fade', type=atLeast(1), default=3,
+        help='steps of brightness the trail fades through')
+    args = parser.parse_args()
+    TermProjectDemo(source=args.source, record=args.record, recordInputs=args.record_inputs,
+                    trailLength=args.trail_length, trailFade=args.trail_fade,
+                    instrument=args.instrument, production=args.production,
+                    logDrawingCalls=args.draw_log, width=1000, height=800)
 
 def clear():
     cap = cv.VideoCapture(0)
     cap.release()
 
-cv.destroyAllWindows()
\ No newline at end of file
+if __name__ == '__main__':
+    cv.destroyAllWindows()
\ No newline at end of file
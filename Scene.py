@@ -0,0 +1,160 @@
+import weakref
+import numpy as np
+
+#################################################
+# Scene buffer
+#
+# Every 3D point GameMode draws (arena lines, ball lines, the trail, and the
+# corners of the ball and paddles) lives in one row of a SceneBuffer, so the
+# whole scene is projected for the current head position with a few NumPy
+# operations per tick instead of a Python call per line. Scene objects keep
+# the index of their rows and read their projected points back as views.
+#################################################
+
+class SceneBuffer(object):
+    def __init__(self, capacity=64):
+        self.points = np.zeros((capacity, 3))    # x, y, z per row
+        self.projected = np.zeros((capacity, 2)) # screen x, y per row
+        self.scale = np.zeros(capacity)          # scratch for project()
+        self.size = 0       # rows at or past size have never been handed out
+        self.free = dict()  # maps a number of rows to a list of freed first rows
+
+    def allocate(self, rows):
+        # returns the first of `rows` consecutive rows, reusing freed ones first
+        freed = self.free.get(rows, None)
+        if freed:
+            return freed.pop()
+        if self.size + rows > len(self.points):
+            self.grow(max(2 * len(self.points), self.size + rows))
+        row = self.size
+        self.size += rows
+        return row
+
+    def release(self, row, rows):
+        self.free.setdefault(rows, [ ]).append(row)
+
+    def grow(self, capacity):
+        # objects hold row numbers, not views, so they survive the copy
+        for name in ['points', 'projected', 'scale']:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:])
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def project(self, faceX, faceY, distance):
+        # perspective from the head at (faceX, faceY), distance in front of the
+        # screen, for every row at once: p' = face + (p - face) * d/(d + z)
+        n = self.size
+        points, projected, scale = self.points[:n], self.projected[:n], self.scale[:n]
+        np.add(points[:, 2], distance, out=scale)
+        np.divide(distance, scale, out=scale)
+        np.subtract(points[:, :2], (faceX, faceY), out=projected)
+        np.multiply(projected, scale[:, None], out=projected)
+        np.add(projected, (faceX, faceY), out=projected)
+
+class SceneObject(object):
+    # Owns `rows` consecutive rows of a SceneBuffer; they go back on the
+    # buffer's free list when the object is garbage collected. The first two
+    # rows are the object's start and end points. Slotted, with a slot for
+    # the weak reference weakref.finalize needs.
+    __slots__ = ('scene', 'row', '__weakref__')
+
+    def __init__(self, scene, rows=2):
+        self.scene = scene
+        self.row = scene.allocate(rows)
+        weakref.finalize(self, scene.release, self.row, rows)
+
+    def setPoints(self, start, end):
+        points = self.scene.points
+        points[self.row] = start
+        points[self.row + 1] = end
+
+    @property
+    def projectedStart(self):
+        return self.scene.projected[self.row]
+
+    @property
+    def projectedEnd(self):
+        return self.scene.projected[self.row + 1]
+
+class Trail(SceneObject):
+    # The last `length` positions of something moving, in a ring of rows of a
+    # SceneBuffer: add() overwrites the oldest, so a trail of any length
+    # costs one row assignment per step and is projected with the rest of
+    # the scene. getBands() gives it back as `fade` polylines, oldest first,
+    # for drawing each a little brighter than the last.
+    __slots__ = ('length', 'fade', 'head', 'count')
+
+    def __init__(self, scene, length=6, fade=3):
+        if length < 2:
+            raise Exception(f'A trail needs at least 2 positions, not {length}')
+        if fade < 1:
+            raise Exception(f'A trail needs at least 1 fade band, not {fade}')
+        super().__init__(scene, rows=length)
+        self.length = length
+        self.fade = fade
+        self.head = 0  # the row add() writes next, relative to self.row
+        self.count = 0 # how many of the rows hold positions
+
+    def add(self, point):
+        self.scene.points[self.row + self.head] = point
+        self.head = (self.head + 1) % self.length
+        self.count = min(self.count + 1, self.length)
+
+    def clear(self):
+        self.count = 0
+
+    def getProjected(self):
+        # the projected positions, oldest first, as a (count, 2) array
+        projected = self.scene.projected[self.row:self.row + self.length]
+        start = self.head - self.count
+        if start >= 0:
+            return projected[start:self.head]
+        return np.concatenate([projected[start:], projected[:self.head]])
+
+    def getBands(self):
+        # a flat [x0, y0, x1, y1, ...] list per band, oldest first; bands
+        # share their end points, and short trails get fewer bands
+        points = self.getProjected()
+        segments = len(points) - 1
+        bands = min(self.fade, segments)
+        return [ points[band * segments//bands:(band + 1) * segments//bands + 1].ravel().tolist()
+                 for band in range(max(0, bands)) ]
+
+class ProjectionCache(object):
+    # Projects a SceneBuffer of geometry that never moves (the arena) only
+    # when the head has moved more than threshold since the last projection.
+    # With a quantum, head positions are first snapped to multiples of it, so
+    # the projection always uses one of a few nearby head positions.
+    def __init__(self, scene, threshold=0, quantum=None):
+        self.scene = scene
+        self.threshold = threshold
+        self.quantum = quantum
+        self.key = None # (faceX, faceY, distance, rows) of the cached projection
+        self.hits = 0
+        self.misses = 0
+
+    def project(self, faceX, faceY, distance):
+        # returns True if the scene was projected again
+        if self.quantum:
+            q = self.quantum
+            faceX, faceY = round(faceX/q) * q, round(faceY/q) * q
+        key = self.key
+        if ((key != None) and (key[3] == self.scene.size) and (key[2] == distance) and
+            abs(faceX - key[0]) <= self.threshold and abs(faceY - key[1]) <= self.threshold):
+            self.hits += 1
+            return False
+        self.misses += 1
+        self.scene.project(faceX, faceY, distance)
+        self.key = (faceX, faceY, distance, self.scene.size)
+        return True
+
+    def invalidate(self):
+        # call after moving any of the cached points
+        self.key = None
+
+    def getStats(self):
+        total = self.hits + self.misses
+        return { 'hits': self.hits,
+                 'misses': self.misses,
+                 'hitRate': (self.hits/total if total > 0 else 0) }
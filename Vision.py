@@ -0,0 +1,504 @@
+import queue
+import time
+import numpy as np
+import cv2 as cv
+from multiprocessing import get_context
+try: from multiprocessing import shared_memory
+except ImportError: shared_memory = None # Python < 3.8, use the in-process pipeline
+
+#################################################
+# Vision pipeline
+#
+# Paddle (colour threshold) and face (haar cascade) tracking. VisionPipeline
+# runs the whole OpenCV chain on one raw camera frame; VisionProcess runs the
+# same pipeline in a worker process, passing frames through a ring of
+# preallocated shared memory buffers so that only a small result tuple goes
+# back through a queue.
+#################################################
+
+def getLargestFace(faces):
+    largestArea = 0
+    largestFace = False
+    for face in faces:
+        (x, y, w, h) = face
+        area = w * h
+        if area > largestArea:
+            largestArea = area
+            largestFace = face
+    return largestFace
+
+class ColorModel(object):
+    # Colour classifier built once from calibration pixels: a coarse 3D hsv
+    # histogram, thresholded into a 0/255 lookup table and grown by `spread`
+    # bins so nearby shades still match. Each frame is then classified with
+    # one table lookup per pixel. Unlike a single inRange box it can hold
+    # several separate clusters, e.g. both sides of a paddle under different
+    # light, without accepting everything in between. The lookup costs
+    # several times an inRange, so apply() first finds the pixels inside the
+    # box around everything the table accepts with an inRange, and only looks
+    # up the rectangle they span.
+    bins = (30, 32, 32)
+
+    def __init__(self, samples, spread=1, minFraction=0.002):
+        samples = np.asarray(samples, np.uint8).reshape(-1, 3)
+        ## per channel value -> bin, applied to all three channels by one cv.LUT ##
+        values = np.arange(256)
+        self.quantize = np.zeros((256, 1, 3), np.uint8)
+        self.quantize[:, 0, 0] = np.minimum(values * self.bins[0] // 180, self.bins[0] - 1)
+        self.quantize[:, 0, 1] = values * self.bins[1] // 256
+        self.quantize[:, 0, 2] = values * self.bins[2] // 256
+        codes = (self.getCodes(samples.reshape(-1, 1, 3)).ravel() if len(samples) > 0
+                 else np.zeros(0, np.uint16))
+        hist = np.bincount(codes, minlength=int(np.prod(self.bins)))
+        ## ignore bins that only caught a stray background pixel or two, once
+        ## there are enough samples to tell; with a few hundred every one counts ##
+        table = (hist > minFraction * len(samples)).reshape(self.bins)
+        table = self.grow(table, spread)
+        self.table = (table * 255).astype(np.uint8).ravel()
+        ## nothing to match (no samples), the pipeline falls back to hsvBounds ##
+        self.empty = not table.any()
+        ## the hsv box around every accepted bin, for apply's first pass ##
+        self.low, self.high = np.zeros(3, np.uint8), np.zeros(3, np.uint8)
+        if not self.empty:
+            for (channel, accepted) in enumerate(np.nonzero(table)):
+                quantized = self.quantize[:, 0, channel]
+                values = np.flatnonzero((quantized >= accepted.min()) &
+                                        (quantized <= accepted.max()))
+                self.low[channel], self.high[channel] = values.min(), values.max()
+
+    @staticmethod
+    def grow(table, spread):
+        # 3D dilation of the table by `spread` bins; hue wraps around
+        for step in range(spread):
+            padded = np.pad(table, ((1, 1), (0, 0), (0, 0)), mode='wrap')
+            padded = np.pad(padded, ((0, 0), (1, 1), (1, 1)), mode='constant')
+            grown = np.zeros_like(table)
+            h, s, v = table.shape
+            for dh in range(3):
+                for ds in range(3):
+                    for dv in range(3):
+                        grown |= padded[dh:dh+h, ds:ds+s, dv:dv+v]
+            table = grown
+        return table
+
+    def getCodes(self, hsv):
+        # flat table index of every pixel: (hueBin * sBins + satBin) * vBins + valBin
+        q = cv.LUT(hsv, self.quantize)
+        codes = q[..., 0].astype(np.uint16)
+        codes *= self.bins[1]
+        codes += q[..., 1]
+        codes *= self.bins[2]
+        codes += q[..., 2]
+        return codes
+
+    def apply(self, hsv):
+        # same as self.table.take(self.getCodes(hsv)), but outside the box
+        # every pixel is 0 anyway
+        mask = cv.inRange(hsv, self.low, self.high)
+        x, y, w, h = cv.boundingRect(mask)
+        if w > 0 and h > 0:
+            mask[y:y+h, x:x+w] = self.table.take(self.getCodes(hsv[y:y+h, x:x+w]))
+        return mask
+
+class FaceTracker(object):
+    # Haar detection is the most expensive stage, so instead of scanning the
+    # full frame every tick we scan a downscaled pyramid level, and once we
+    # have a face only search a padded box around where it was last seen.
+    # The full frame is rescanned every rescanEvery frames or on loss.
+    def __init__(self, cascade, levels=1, padding=0.5, rescanEvery=30):
+        self.cascade = cascade
+        self.levels = levels
+        self.padding = padding
+        self.rescanEvery = rescanEvery
+        self.lastFace = None
+        self.framesSinceScan = 0
+        self.fullScans = 0
+        self.roiScans = 0
+
+    def reset(self):
+        self.lastFace = None
+        self.framesSinceScan = 0
+
+    def downscale(self, gray):
+        for level in range(self.levels):
+            gray = cv.pyrDown(gray)
+        return gray
+
+    def detect(self, gray):
+        # same output as detectMultiScale on the full frame: (x, y, w, h) rows
+        # in full resolution pixels
+        faces = ()
+        if self.lastFace != None and self.framesSinceScan < self.rescanEvery:
+            faces = self.detectNear(gray, self.lastFace)
+            self.framesSinceScan += 1
+        if len(faces) == 0:
+            faces = self.detectFull(gray)
+            self.framesSinceScan = 0
+        largestFace = getLargestFace(faces)
+        if isinstance(largestFace, np.ndarray):
+            self.lastFace = tuple(int(v) for v in largestFace)
+        else:
+            self.lastFace = None
+        return faces
+
+    def detectFull(self, gray):
+        self.fullScans += 1
+        k = 2**self.levels
+        faces = self.cascade.detectMultiScale(self.downscale(gray), 1.1, 4)
+        if len(faces) == 0:
+            return ()
+        return faces * k
+
+    def detectNear(self, gray, face):
+        self.roiScans += 1
+        (x, y, w, h) = face
+        pad = int(self.padding * max(w, h))
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(gray.shape[1], x + w + pad), min(gray.shape[0], y + h + pad)
+        k = 2**self.levels
+        roi = self.downscale(gray[y0:y1, x0:x1])
+        ## the head can't change size much between frames ##
+        minSize = (int(w/k/2), int(h/k/2))
+        maxSize = (int(w/k*2), int(h/k*2))
+        faces = self.cascade.detectMultiScale(roi, 1.1, 4, minSize=minSize, maxSize=maxSize)
+        if len(faces) == 0:
+            return ()
+        faces = faces * k
+        faces[:, 0] += x0
+        faces[:, 1] += y0
+        return faces
+
+class PaddleTracker(object):
+    # The paddle only moves a few pixels a frame, so predict where its box
+    # will be from its recent velocity (constant velocity model) and only
+    # threshold that window. Callers fall back to the full frame on loss.
+    def __init__(self, margin=30, smoothing=0.5):
+        self.margin = margin
+        self.smoothing = smoothing
+        self.box = None
+        self.vx, self.vy = 0, 0
+        self.fullScans = 0
+        self.windowScans = 0
+
+    def reset(self):
+        self.box = None
+        self.vx, self.vy = 0, 0
+
+    def predictWindow(self, shape):
+        if self.box == None:
+            return None
+        x0, y0, x1, y1 = self.box
+        ## room for the kernel to close across the edges plus any surprise ##
+        padX = self.margin + (x1 - x0)/2 + abs(self.vx)
+        padY = self.margin + (y1 - y0)/2 + abs(self.vy)
+        height, width = shape[0], shape[1]
+        wx0 = int(max(0, x0 + self.vx - padX))
+        wy0 = int(max(0, y0 + self.vy - padY))
+        wx1 = int(min(width, x1 + self.vx + padX))
+        wy1 = int(min(height, y1 + self.vy + padY))
+        if wx1 <= wx0 or wy1 <= wy0:
+            return None
+        return (wx0, wy0, wx1, wy1)
+
+    def update(self, box):
+        if box != None and self.box != None:
+            dx = (box[0] + box[2] - self.box[0] - self.box[2])/2
+            dy = (box[1] + box[3] - self.box[1] - self.box[3])/2
+            a = self.smoothing
+            self.vx = a * dx + (1 - a) * self.vx
+            self.vy = a * dy + (1 - a) * self.vy
+        else:
+            self.vx, self.vy = 0, 0
+        self.box = box
+
+class VisionScheduler(object):
+    # Decides each frame which detectors fit in the time budget (ms). Stage
+    # costs are tracked as moving averages; the priority stage always runs,
+    # the other one runs if it still fits or has been skipped maxSkips
+    # frames in a row. A skipped stage reuses its last result.
+    stages = ['paddle', 'face']
+
+    def __init__(self, budget=8, maxSkips=5, smoothing=0.2):
+        self.budget = budget
+        self.maxSkips = maxSkips
+        self.smoothing = smoothing
+        self.costs = dict.fromkeys(self.stages, 0)
+        self.lastCosts = dict.fromkeys(self.stages, 0)
+        self.skips = dict.fromkeys(self.stages, 0)
+        self.runs = dict.fromkeys(self.stages, 0)
+        self.decisions = dict.fromkeys(self.stages, True)
+        self.priority = 'paddle'
+        self.frames = 0
+        self.overBudget = 0
+        self.frameCost = 0
+
+    def plan(self, priority):
+        self.priority = priority
+        order = sorted(self.stages, key=lambda stage: stage != priority)
+        plan = [ ]
+        remaining = self.budget
+        for stage in order:
+            cost = self.costs[stage]
+            if plan == [ ] or cost <= remaining or self.skips[stage] >= self.maxSkips:
+                plan.append(stage)
+                remaining -= cost
+                self.skips[stage] = 0
+            else:
+                self.skips[stage] += 1
+            self.decisions[stage] = (stage in plan)
+        self.frameCost = 0
+        return plan
+
+    def record(self, stage, seconds):
+        ms = seconds * 1000
+        a = self.smoothing
+        if self.runs[stage] == 0:
+            self.costs[stage] = ms
+        else:
+            self.costs[stage] = a * ms + (1 - a) * self.costs[stage]
+        self.lastCosts[stage] = ms
+        self.runs[stage] += 1
+        self.frameCost += ms
+
+    def endFrame(self):
+        self.frames += 1
+        if self.frameCost > self.budget:
+            self.overBudget += 1
+
+    def getStats(self):
+        # small and picklable, this is what the worker sends back each frame
+        return { 'priority': self.priority,
+                 'budget': self.budget,
+                 'decisions': dict(self.decisions),
+                 'costs': dict(self.costs),
+                 'lastCosts': dict(self.lastCosts),
+                 'runs': dict(self.runs),
+                 'frameCost': self.frameCost,
+                 'frames': self.frames,
+                 'overBudget': self.overBudget }
+
+class VisionPipeline(object):
+    def __init__(self, cascadePath='haarcascade_frontalface_default.xml'):
+        self.faceCascade = cv.CascadeClassifier(cascadePath)
+        self.faceTracker = FaceTracker(self.faceCascade)
+        self.hsvBounds = (0, 255, 0, 255, 0, 255)
+        ## replaces hsvBounds once calibration has built one ##
+        self.colorModel = None
+        self.kernal = np.ones( (10, 10), np.uint8)
+        ## camera pixels -> game coordinates ##
+        self.k = 2
+        self.paddleTracker = PaddleTracker()
+        self.scheduler = VisionScheduler()
+        ## 'paddle' while rallying, 'face' while the game is counting down or paused ##
+        self.priority = 'paddle'
+        self.tracker = None
+        self.gray = None
+
+    def process(self, frame):
+        # takes a raw camera frame, returns the mirrored frame with the paddle
+        # and face boxes drawn on it, and (paddleX, paddleY, faceX, faceY, headSize)
+        # with None in place of anything that wasn't found
+        frame = cv.flip(frame, 1)
+        plan = self.scheduler.plan(self.priority)
+        if 'paddle' in plan:
+            start = time.perf_counter()
+            paddleX, paddleY = self.findPaddle(frame)
+            self.scheduler.record('paddle', time.perf_counter() - start)
+        else:
+            paddleX, paddleY = None, None
+        if 'face' in plan:
+            start = time.perf_counter()
+            gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+            self.gray = gray
+            faceX, faceY, headSize = self.findFace(gray)
+            self.scheduler.record('face', time.perf_counter() - start)
+        else:
+            faceX, faceY, headSize = None, None, None
+        ## boxes go on only now, so the trackers never see them ##
+        self.drawBoxes(frame)
+        self.scheduler.endFrame()
+        return frame, (paddleX, paddleY, faceX, faceY, headSize)
+
+    def drawBoxes(self, frame):
+        # the paddle and face as last found, whether or not they were looked for this frame
+        box = self.paddleTracker.box
+        if box != None:
+            x0, y0, x1, y1 = box
+            cv.rectangle(frame, (x0,y0), (x1, y1), (0,255,0), 2)
+        face = self.faceTracker.lastFace
+        if face != None:
+            (x, y, w, h) = face
+            cv.rectangle(frame, (x,y), (x+w, y+h), (0,0,255), 2)
+
+    def findPaddle(self, frame):
+        if self.tracker is None or self.tracker.shape != frame.shape[:2]:
+            self.tracker = np.zeros(frame.shape[:2], np.uint8)
+        self.tracker.fill(0)
+        window = self.paddleTracker.predictWindow(frame.shape)
+        box = self.findPaddleIn(frame, window)
+        if box == None and window != None:
+            ## lost it, look everywhere ##
+            box = self.findPaddleIn(frame, None)
+        self.paddleTracker.update(box)
+        if box == None:
+            return None, None
+        x0, y0, x1, y1 = box
+        k = self.k
+        return k*(x0+x1)/2, k*(y0+y1)/2
+
+    def findPaddleIn(self, frame, window):
+        # threshold, close and find contours only inside window (x0, y0, x1, y1),
+        # or the whole frame if window is None. Returns the paddle box or None.
+        if window == None:
+            window = (0, 0, frame.shape[1], frame.shape[0])
+            self.paddleTracker.fullScans += 1
+        else:
+            self.paddleTracker.windowScans += 1
+        wx0, wy0, wx1, wy1 = window
+        hsv = cv.cvtColor(frame[wy0:wy1, wx0:wx1], cv.COLOR_BGR2HSV)
+
+        if self.colorModel != None and not self.colorModel.empty:
+            ## the model's mask is clean enough that one close will do ##
+            mask = self.colorModel.apply(hsv)
+            tracker = cv.morphologyEx(mask, cv.MORPH_CLOSE, self.kernal, iterations=1)
+        else:
+            l_h, u_h, l_s, u_s, l_v, u_v = self.hsvBounds
+            l_c = np.array([l_h, l_s, l_v])
+            u_c = np.array([u_h, u_s, u_v])
+            mask = cv.inRange(hsv, l_c, u_c)
+            tracker = cv.morphologyEx(mask, cv.MORPH_CLOSE, self.kernal, iterations=3)
+        self.tracker[wy0:wy1, wx0:wx1] = tracker
+
+        ## holes lie inside their outer contour, so the outer ones give the same box ##
+        contours, _ = cv.findContours(tracker, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE,
+                                      offset=(wx0, wy0))
+        xList = [ ]
+        yList = [ ]
+        for contour in contours:
+            if cv.contourArea(contour) < 40:
+                continue
+            x, y, w, h = cv.boundingRect(contour)
+            xList.extend( [ x, x+w ] )
+            yList.extend( [ y, y+h ] )
+        if xList == [] or yList == []:
+            return None
+        return min(xList), min(yList), max(xList), max(yList)
+
+    def findFace(self, gray):
+        faces = self.faceTracker.detect(gray)
+        primaryFace = getLargestFace(faces)
+        if not isinstance(primaryFace, np.ndarray):
+            return None, None, None
+        (x, y, w, h) = primaryFace
+        k = self.k
+        return k*(x+w/2), k*(y+h/2), h
+
+#################################################
+# Worker process
+#################################################
+
+def getRingViews(buffer, shape, slots):
+    # each slot holds one BGR frame followed by its single channel tracker mask
+    frameBytes = int(np.prod(shape))
+    maskBytes = shape[0] * shape[1]
+    frames, masks = [ ], [ ]
+    for slot in range(slots):
+        offset = slot * (frameBytes + maskBytes)
+        frames.append(np.ndarray(shape, np.uint8, buffer=buffer, offset=offset))
+        masks.append(np.ndarray(shape[:2], np.uint8, buffer=buffer, offset=offset+frameBytes))
+    return frames, masks
+
+def visionWorker(shmName, shape, slots, jobs, results):
+    shm = shared_memory.SharedMemory(name=shmName)
+    frames, masks = getRingViews(shm.buf, shape, slots)
+    pipeline = VisionPipeline()
+    try:
+        running = True
+        while running:
+            ## wait for work, then drain the queue so we only process the newest frame ##
+            pending = [ jobs.get() ]
+            while True:
+                try: pending.append(jobs.get_nowait())
+                except queue.Empty: break
+            frameJobs = [ ]
+            for job in pending:
+                if job is None:
+                    running = False
+                elif job[0] == 'set':
+                    setattr(pipeline, job[1], job[2])
+                else:
+                    frameJobs.append(job)
+            for (_, slot, seq) in frameJobs[:-1]:
+                results.put( (slot, seq, None, None) )
+            if frameJobs == [ ] or not running:
+                continue
+            (_, slot, seq) = frameJobs[-1]
+            frame, values = pipeline.process(frames[slot])
+            np.copyto(frames[slot], frame)
+            np.copyto(masks[slot], pipeline.tracker)
+            results.put( (slot, seq, values, pipeline.scheduler.getStats()) )
+    finally:
+        del frames, masks # the views must go before the segment can be closed
+        shm.close()
+
+class VisionProcess(object):
+    def __init__(self, shape, slots=3):
+        # spawn rather than fork: the parent already has Tk and a capture thread
+        context = get_context('spawn')
+        self.shape = tuple(shape)
+        self.slots = slots
+        slotBytes = int(np.prod(self.shape)) + self.shape[0] * self.shape[1]
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slotBytes)
+        self.frames, self.masks = getRingViews(self.shm.buf, self.shape, slots)
+        self.free = list(range(slots))
+        self.latestSeq = 0
+        self.options = { }
+        self.stats = None
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=visionWorker,
+            args=(self.shm.name, self.shape, slots, self.jobs, self.results),
+            daemon=True)
+        self.process.start()
+
+    def update(self, **options):
+        # forward pipeline settings (hsvBounds, priority) to the worker when they change
+        for name in options:
+            if self.options.get(name, None) != options[name]:
+                self.options[name] = options[name]
+                self.jobs.put( ('set', name, options[name]) )
+
+    def submit(self, frame, seq):
+        # copy a raw frame into a free slot, returns False if the ring is full
+        if frame.shape != self.shape or self.free == [ ]:
+            return False
+        slot = self.free.pop(0)
+        np.copyto(self.frames[slot], frame)
+        self.jobs.put( ('frame', slot, seq) )
+        return True
+
+    def poll(self):
+        # never blocks: returns the newest finished (seq, frame, tracker, values)
+        # or None. frame and tracker are copied out so the slot can be reused.
+        latest = None
+        while True:
+            try: slot, seq, values, stats = self.results.get_nowait()
+            except queue.Empty: break
+            if values is not None and seq > self.latestSeq:
+                self.latestSeq = seq
+                self.stats = stats
+                latest = (seq, self.frames[slot].copy(), self.masks[slot].copy(), values)
+            self.free.append(slot)
+        return latest
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.jobs.put(None)
+        self.process.join(timeout=1.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.frames, self.masks = [ ], [ ]
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
@@ -25,6 +25,30 @@ LAST_UPDATED  = datetime.date(year=2019, month=10, day=24)
 #   * replace/augment tkinter canvas with PIL/Pillow imageDraw (perhaps with our own fn names)
 #   * use snake_case and CapWords
 
+# Local changes for VR Pong (on top of v0.8.5)
+#   * Opt-in frame timing: App(..., instrument=True) records how long each user callback
+#     takes (per active Mode), tick-to-tick jitter and achieved fps vs timerDelay
+#       * control-t toggles an on-canvas overlay, control-d dumps the stats to frameStats.json
+#       * app.timed(name) times any other section, as in: with app.timed('vision'): ...
+#   * Retained-mode drawing: canvas.retain_line(key, ...), retain_rectangle, retain_oval, retain_text,
+#     retain_polygon and retain_image keep one canvas item per key across redraws and only update
+#     its coords/options when they change. Items not retained in a redraw are deleted after it.
+#     Retained items always stay beneath the ordinary create_* items, in the order first drawn.
+#   * create_image(pilImage=image) and retain_image(key, ..., pilImage=image) convert each PIL image
+#     to a PhotoImage once and reuse it on later redraws (canvas.getTkImage(image)). A cached
+#     PhotoImage is dropped when its PIL image is garbage collected, so replace images rather than
+#     drawing into them in place.
+#   * Cheap MVC checking: every attribute write on an App or Mode bumps a generation counter, and
+#     redrawAll only compares generations (of the app and its active mode) before and after.
+#     Writes like app.x = 1 in redrawAll are reported where they happen again (the old
+#     running/mvcCheck test never fired). mvcCheck='deep' restores the old getHash comparison,
+#     which also catches in-place changes (app.L.append(1)) but reprs every big array in the model.
+#     App(..., production=True) turns MVC checking and drawing-call logging off entirely.
+#   * The drawing-call log is off by default and pluggable: App(logDrawingCalls=...) takes False or 0 (off), True (the
+#     last redraw, in canvas.loggedDrawingCalls, as before), a number of redraws to keep (DrawCallRing)
+#     or a path to stream every redraw to as JSON lines (DrawCallStream). canvas.drawCalls counts
+#     the calls in the current redraw either way, and instrumented apps report it as 'drawCalls'.
+
 # Chages in v0.8.5
 #   * Support loadImage from Modes
 
@@ -139,8 +163,9 @@ LAST_UPDATED  = datetime.date(year=2019, month=10, day=24)
 
 from tkinter import *
 from tkinter import messagebox, simpledialog, filedialog
-import inspect, copy, traceback
-import sys, os
+import inspect, copy, traceback, weakref
+import sys, os, time, json
+from collections import deque
 from io import BytesIO
 
 def failedImport(importName, installName=None):
@@ -177,21 +202,249 @@ def getHash(obj):
             try: return hash(obj)
             except: return getHash(repr(obj))
 
+class FrameStats(object):
+    # Rolling timings for App(..., instrument=True). Keeps the last windowSize
+    # samples of every named section plus a histogram of that same window
+    # (bucketEdges are the upper bounds in ms), and the times of recent ticks.
+    bucketEdges = [1, 2, 4, 8, 16, 33, 50, 100, float('inf')]
+
+    def __init__(self, windowSize=300):
+        self.windowSize = windowSize
+        self.samples = dict()    # maps name to deque of ms
+        self.histograms = dict() # maps name to bucket counts over the window
+        self.tickTimes = deque(maxlen=windowSize+1)
+        self.counts = dict()     # maps name to deque of per-frame counts
+        self.showOverlay = False
+
+    def getBucket(self, ms):
+        for i in range(len(self.bucketEdges)):
+            if ms <= self.bucketEdges[i]: return i
+
+    def record(self, name, seconds):
+        ms = seconds * 1000
+        if (name not in self.samples):
+            self.samples[name] = deque()
+            self.histograms[name] = [0] * len(self.bucketEdges)
+        samples, histogram = self.samples[name], self.histograms[name]
+        if (len(samples) == self.windowSize):
+            histogram[self.getBucket(samples.popleft())] -= 1
+        samples.append(ms)
+        histogram[self.getBucket(ms)] += 1
+
+    def recordCount(self, name, n):
+        if (name not in self.counts):
+            self.counts[name] = deque(maxlen=self.windowSize)
+        self.counts[name].append(n)
+
+    def getCountStats(self, name):
+        counts = self.counts[name]
+        return { 'count': len(counts),
+                 'mean': sum(counts) / len(counts),
+                 'max': max(counts),
+                 'last': counts[-1] }
+
+    def tick(self, now):
+        self.tickTimes.append(now)
+
+    def getTickStats(self, timerDelay):
+        ticks = self.tickTimes
+        intervals = [(ticks[i+1] - ticks[i]) * 1000 for i in range(len(ticks)-1)]
+        if (len(intervals) == 0):
+            return { 'fps': 0, 'targetFps': 1000/max(timerDelay, 1), 'meanTickMs': 0, 'jitterMs': 0 }
+        mean = sum(intervals) / len(intervals)
+        jitter = (sum((v - mean)**2 for v in intervals) / len(intervals))**0.5
+        return { 'fps': 1000/mean if mean > 0 else 0,
+                 'targetFps': 1000/max(timerDelay, 1),
+                 'meanTickMs': mean,
+                 'jitterMs': jitter }
+
+    def getSectionStats(self, name):
+        samples = sorted(self.samples[name])
+        n = len(samples)
+        return { 'count': n,
+                 'meanMs': sum(samples) / n,
+                 'p95Ms': samples[min(n-1, int(0.95 * n))],
+                 'maxMs': samples[-1],
+                 'histogram': dict(zip([str(edge) for edge in self.bucketEdges], self.histograms[name])) }
+
+    def getReport(self, timerDelay):
+        return { 'ticks': self.getTickStats(timerDelay),
+                 'sections': { name: self.getSectionStats(name) for name in self.samples },
+                 'counts': { name: self.getCountStats(name) for name in self.counts } }
+
+    def dump(self, path, timerDelay):
+        with open(path, 'wt') as f:
+            json.dump(self.getReport(timerDelay), f, indent=2)
+
+    def draw(self, canvas, timerDelay):
+        ticks = self.getTickStats(timerDelay)
+        lines = [ f"{ticks['fps']:.1f} fps (target {ticks['targetFps']:.0f})  jitter {ticks['jitterMs']:.1f} ms" ]
+        for name in sorted(self.counts):
+            stats = self.getCountStats(name)
+            lines.append(f"{name}: {stats['last']}  mean {stats['mean']:.0f}  max {stats['max']}")
+        sections = sorted(self.samples, key=lambda name: -self.getSectionStats(name)['meanMs'])
+        for name in sections[:8]:
+            stats = self.getSectionStats(name)
+            lines.append(f"{name}: {stats['meanMs']:.1f} ms  p95 {stats['p95Ms']:.1f}")
+        canvas.create_rectangle(5, 5, 365, 12 + 15*len(lines), fill='black', outline='yellow')
+        canvas.create_text(10, 10, text='\n'.join(lines), anchor='nw', fill='yellow', font='Courier 10')
+
+class _TimedSection(object):
+    def __init__(self, stats, name):
+        self.stats, self.name = stats, name
+    def __enter__(self):
+        self.start = time.perf_counter()
+    def __exit__(self, *exc):
+        if (self.stats is not None): self.stats.record(self.name, time.perf_counter() - self.start)
+
+class DrawCallRing(object):
+    # Keeps the drawing calls of the last `frames` redraws in memory, as lists
+    # of (methodName, args, kwargs), oldest first
+    def __init__(self, frames=1):
+        if (frames < 1): raise Exception(f'DrawCallRing needs at least 1 frame, not {frames}')
+        self.frames = deque(maxlen=frames)
+
+    def beginFrame(self, frameIndex):
+        self.frames.append([ ])
+        return self.frames[-1]
+
+    def record(self, methodName, args, kwargs):
+        self.frames[-1].append((methodName, args, kwargs))
+
+    def endFrame(self): pass
+    def close(self): pass
+
+class DrawCallStream(object):
+    # Writes each redraw's drawing calls to path as one line of JSON, as in
+    # {"frame": 12, "calls": [["create_line", [0, 0, 10, 10], {"fill": "red"}], ...]}
+    # (anything that isn't JSON, like a PhotoImage, is written as its repr)
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wt')
+        self.frameIndex = 0
+        self.calls = [ ]
+
+    def beginFrame(self, frameIndex):
+        self.frameIndex = frameIndex
+        self.calls = [ ]
+        return self.calls
+
+    def record(self, methodName, args, kwargs):
+        self.calls.append((methodName, args, kwargs))
+
+    def endFrame(self):
+        if (self.file is None): return
+        json.dump({ 'frame': self.frameIndex, 'calls': self.calls }, self.file, default=repr)
+        self.file.write('\n')
+
+    def close(self):
+        if (self.file is not None): self.file.close()
+        self.file = None
+
+def makeDrawCallLog(logDrawingCalls):
+    # App(logDrawingCalls=...): False/None/0, True, a number of redraws, a path, or a log object
+    if (not logDrawingCalls): return None
+    elif (logDrawingCalls is True): return DrawCallRing(1)
+    elif (isinstance(logDrawingCalls, int)): return DrawCallRing(logDrawingCalls)
+    elif (isinstance(logDrawingCalls, str)): return DrawCallStream(logDrawingCalls)
+    else: return logDrawingCalls
+
 class WrappedCanvas(Canvas):
     # Enforces MVC: no drawing outside calls to redrawAll
-    # Logs draw calls (for autograder) in canvas.loggedDrawingCalls
+    # Logs draw calls (for autograder) to canvas.drawCallLog, if there is one,
+    # and counts them in canvas.drawCalls
+    # Retained items (see retain) persist across redraws; everything else is
+    # deleted at the start of each redraw
     def __init__(wrappedCanvas, app):
-        wrappedCanvas.loggedDrawingCalls = [ ]
-        wrappedCanvas.logDrawingCalls = True
+        wrappedCanvas.loggedDrawingCalls = [ ] # this redraw's, when logging
+        wrappedCanvas.drawCallLog = app._drawCallLog
+        wrappedCanvas.drawCalls = 0
+        wrappedCanvas.frameIndex = 0
         wrappedCanvas.inRedrawAll = False
         wrappedCanvas.app = app
+        wrappedCanvas.retainedItems = dict() # maps key to [kind, itemId, coords, options]
+        wrappedCanvas.retainedThisFrame = set()
+        wrappedCanvas.lastRetainedId = None
+        wrappedCanvas.tkImageCache = dict() # maps id(pilImage) to (weakref to pilImage, PhotoImage)
+        wrappedCanvas.frameImages = [ ] # keeps this redraw's PhotoImages alive until the next one
         super().__init__(app._root, width=app.width, height=app.height)
 
+    def beginFrame(self):
+        super().delete('!retained')
+        self.retainedThisFrame = set()
+        self.lastRetainedId = None
+        self.frameImages = [ ]
+        self.drawCalls = 0
+        self.frameIndex += 1
+        if (self.drawCallLog is not None):
+            self.loggedDrawingCalls = self.drawCallLog.beginFrame(self.frameIndex)
+
+    def endFrame(self):
+        for key in list(self.retainedItems):
+            if (key not in self.retainedThisFrame):
+                super().delete(self.retainedItems.pop(key)[1])
+        if (self.drawCallLog is not None):
+            self.drawCallLog.endFrame()
+
+    def retain(self, kind, key, *coords, **options):
+        self.log('retain_' + kind, (key,) + coords, options)
+        if ((len(coords) == 1) and not isinstance(coords[0], (int, float, str))):
+            coords = tuple(coords[0]) # a single list/tuple/array of coords
+        self.retainedThisFrame.add(key)
+        item = self.retainedItems.get(key, None)
+        if ((item is None) or (item[0] != kind)):
+            if (item is not None): super().delete(item[1])
+            itemId = getattr(Canvas, 'create_' + kind)(self, *coords, tags='retained', **options)
+            # keep retained items in the order they are drawn, and beneath the rest
+            if (self.lastRetainedId is None): self.tag_lower(itemId)
+            else: self.tag_raise(itemId, self.lastRetainedId)
+            # (holding options also keeps any PhotoImage alive as long as its item)
+            self.retainedItems[key] = [kind, itemId, coords, options]
+        else:
+            itemId = item[1]
+            if (coords != item[2]):
+                self.coords(itemId, *coords)
+                item[2] = coords
+            if (options != item[3]):
+                changed = { name: options[name] for name in options
+                            if ((name not in item[3]) or (item[3][name] is not options[name] and
+                                                          item[3][name] != options[name])) }
+                if (changed): self.itemconfigure(itemId, **changed)
+                item[3] = options
+        self.lastRetainedId = itemId
+        return itemId
+
+    def retain_line(self, key, *args, **kwargs): return self.retain('line', key, *args, **kwargs)
+    def retain_oval(self, key, *args, **kwargs): return self.retain('oval', key, *args, **kwargs)
+    def retain_polygon(self, key, *args, **kwargs): return self.retain('polygon', key, *args, **kwargs)
+    def retain_rectangle(self, key, *args, **kwargs): return self.retain('rectangle', key, *args, **kwargs)
+    def retain_text(self, key, *args, **kwargs): return self.retain('text', key, *args, **kwargs)
+    def retain_image(self, key, *args, **kwargs):
+        if ('pilImage' in kwargs):
+            kwargs['image'] = self.getTkImage(kwargs.pop('pilImage'))
+        elif (isinstance(kwargs.get('image', None), Image.Image)):
+            raise Exception('retain_image: image must be a Tkinter PhotoImage, not a PIL/Pillow image')
+        return self.retain('image', key, *args, **kwargs)
+
+    def getTkImage(self, pilImage):
+        # one PhotoImage per live PIL image, evicted when the PIL image goes away
+        key = id(pilImage)
+        entry = self.tkImageCache.get(key, None)
+        if ((entry is not None) and (entry[0]() is pilImage)):
+            return entry[1]
+        def evict(ref, key=key):
+            entry = self.tkImageCache.get(key, None)
+            if ((entry is not None) and (entry[0] is ref)): del self.tkImageCache[key]
+        image = ImageTk.PhotoImage(pilImage)
+        self.tkImageCache[key] = (weakref.ref(pilImage, evict), image)
+        return image
+
     def log(self, methodName, args, kwargs):
         if (not self.inRedrawAll):
             self.app._mvcViolation('you may not use the canvas (the view) outside of redrawAll')
-        if (self.logDrawingCalls):
-            self.loggedDrawingCalls.append((methodName, args, kwargs))
+        self.drawCalls += 1
+        if (self.drawCallLog is not None):
+            self.drawCallLog.record(methodName, args, kwargs)
 
     def create_arc(self, *args, **kwargs): self.log('create_arc', args, kwargs); return super().create_arc(*args, **kwargs)
     def create_bitmap(self, *args, **kwargs): self.log('create_bitmap', args, kwargs); return super().create_bitmap(*args, **kwargs)
@@ -215,7 +468,7 @@ class WrappedCanvas(Canvas):
             del kwargs['pilImage']
             if (not isinstance(pilImage, Image.Image)):
                 raise Exception('create_image: pilImage value is not an instance of a PIL/Pillow image')
-            image = ImageTk.PhotoImage(pilImage)
+            image = self.getTkImage(pilImage)
         else:
             image = kwargs['image']
             if (isinstance(image, Image.Image)):
@@ -223,6 +476,8 @@ class WrappedCanvas(Canvas):
                     'You perhaps meant to convert from PIL to Tkinter, like so:\n' +
                     '     canvas.create_image(x, y, image=ImageTk.PhotoImage(image))')
         kwargs['image'] = image
+        # Tk only draws a PhotoImage while the Python object is alive
+        self.frameImages.append(image)
         return super().create_image(*args, **kwargs)
 
 class App(object):
@@ -251,13 +506,17 @@ class App(object):
     # Implementation:
     ####################################
 
-    def __init__(app, width=300, height=300, x=0, y=0, title=None, autorun=True, mvcCheck=True, logDrawingCalls=True):
+    def __init__(app, width=300, height=300, x=0, y=0, title=None, autorun=True, mvcCheck=True, logDrawingCalls=False,
+                 instrument=False, frameStatsPath='frameStats.json', production=False):
         app.winx, app.winy, app.width, app.height = x, y, width, height
         app.timerDelay = 100     # milliseconds
         app.mouseMovedDelay = 50 # ditto
         app._title = title
-        app._mvcCheck = mvcCheck
-        app._logDrawingCalls = logDrawingCalls
+        app._production = production
+        app._mvcCheck = False if production else mvcCheck
+        app._drawCallLog = None if production else makeDrawCallLog(logDrawingCalls)
+        app._frameStats = FrameStats() if instrument else None
+        app._frameStatsPath = frameStatsPath
         app._running = app._paused = False
         app._mousePressedOutsideWindow = False
         if autorun: app.run()
@@ -306,6 +565,28 @@ class App(object):
             if (not path.endswith('.png')): path += '.png'
             app._deferredMethodCall(afterId='saveSnapshot', afterDelay=0, afterFn=lambda:app.getSnapshot().save(path))
 
+    def timed(app, name):
+        # with app.timed('vision'): ... records that block when instrumented
+        return _TimedSection(app._frameStats, name)
+
+    def getDrawCallLog(app):
+        return app._drawCallLog
+
+    def getFrameStats(app):
+        if (app._frameStats is None): return None
+        return app._frameStats.getReport(app.timerDelay)
+
+    def _getCallbackLabel(app, name):
+        return name
+
+    def _timedCall(app, name, fn, *args):
+        stats = app._frameStats
+        if (stats is None): return fn(*args)
+        label = app._getCallbackLabel(name)
+        start = time.perf_counter()
+        try: return fn(*args)
+        finally: stats.record(label, time.perf_counter() - start)
+
     def _togglePaused(app):
         app._paused = not app._paused
 
@@ -316,13 +597,23 @@ class App(object):
     def __setattr__(app, attr, val):
         d = app.__dict__
         d[attr] = val
+        d['_generation'] = d.get('_generation', 0) + 1 # see _getGeneration
         canvas = d.get('_canvas', None)
-        if (d.get('running', False) and
-            d.get('mvcCheck', False) and
+        if (d.get('_running', False) and
+            d.get('_mvcCheck', False) and
             (canvas is not None) and
             canvas.inRedrawAll):
             app._mvcViolation(f'you may not change app.{attr} in the model while in redrawAll (the view)')
 
+    def _getGeneration(app):
+        # changes whenever an attribute of the model is assigned
+        return app.__dict__.get('_generation', 0)
+
+    def _getModelState(app):
+        if (app._mvcCheck == 'deep'): return getHash(app)
+        elif (app._mvcCheck): return app._getGeneration()
+        else: return None
+
     def _printUserTraceback(app, exception, tb):
         stack = traceback.extract_tb(tb)
         lines = traceback.format_list(stack)
@@ -379,20 +670,24 @@ class App(object):
         if (not app._running): return
         if ('deferredRedrawAll' in app._afterIdMap): return # wait for pending call
         app._canvas.inRedrawAll = True
-        app._canvas.delete(ALL)
+        app._canvas.beginFrame()
         width,outline = (10,'red') if app._paused else (0,'white')
-        app._canvas.create_rectangle(0, 0, app.width, app.height, fill='white', width=width, outline=outline)
-        app._canvas.loggedDrawingCalls = [ ]
-        app._canvas.logDrawingCalls = app._logDrawingCalls
-        hash1 = getHash(app) if app._mvcCheck else None
+        app._canvas.retain_rectangle('_background', 0, 0, app.width, app.height, fill='white', width=width, outline=outline)
+        state1 = app._getModelState()
         try:
-            app.redrawAll(app._canvas)
-            hash2 = getHash(app) if app._mvcCheck else None
-            if (hash1 != hash2):
+            app._timedCall('redrawAll', app.redrawAll, app._canvas)
+            state2 = app._getModelState()
+            if (state1 != state2):
                 app._mvcViolation('you may not change the app state (the model) in redrawAll (the view)')
+            if (app._frameStats is not None):
+                app._frameStats.recordCount('drawCalls', app._canvas.drawCalls)
+            if (app._frameStats is not None) and app._frameStats.showOverlay:
+                app._frameStats.draw(app._canvas, app.timerDelay)
         finally:
+            app._canvas.endFrame()
             app._canvas.inRedrawAll = False
-        app._canvas.update()
+        with app.timed('tkUpdate'):
+            app._canvas.update()
 
     def _deferredMethodCall(app, afterId, afterDelay, afterFn, replace=False):
         def afterFnWrapper():
@@ -464,11 +759,17 @@ class App(object):
             app.quit()
         elif (event.key == 'control-x'):
             os._exit(0) # hard exit avoids tkinter error messages
+        elif (event.key == 'control-t') and (app._frameStats is not None):
+            app._frameStats.showOverlay = not app._frameStats.showOverlay
+            app._redrawAllWrapper()
+        elif (event.key == 'control-d') and (app._frameStats is not None):
+            app._frameStats.dump(app._frameStatsPath, app.timerDelay)
+            print(f'Frame stats written to {app._frameStatsPath}')
         elif (app._running and
               (not app._paused) and
               app._methodIsOverridden('keyPressed') and
               (not event.key == 'Modifier_Key')):
-            app.keyPressed(event)
+            app._timedCall('keyPressed', app.keyPressed, event)
             app._redrawAllWrapper()
 
     @_safeMethod
@@ -476,7 +777,7 @@ class App(object):
         if (not app._running) or app._paused or (not app._methodIsOverridden('keyReleased')): return
         event = App.KeyEventWrapper(event)
         if (not event.key == 'Modifier_Key'):
-            app.keyReleased(event)
+            app._timedCall('keyReleased', app.keyReleased, event)
             app._redrawAllWrapper()
 
     @_safeMethod
@@ -490,7 +791,7 @@ class App(object):
             app._mouseIsPressed = True
             app._lastMousePosn = (event.x, event.y)
             if (app._methodIsOverridden('mousePressed')):
-                app.mousePressed(event)
+                app._timedCall('mousePressed', app.mousePressed, event)
                 app._redrawAllWrapper()
 
     @_safeMethod
@@ -503,14 +804,15 @@ class App(object):
         else:
             app._lastMousePosn = (event.x, event.y)
             if (app._methodIsOverridden('mouseReleased')):
-                app.mouseReleased(event)
+                app._timedCall('mouseReleased', app.mouseReleased, event)
                 app._redrawAllWrapper()
 
     @_safeMethod
     def _timerFiredWrapper(app):
         if (not app._running) or (not app._methodIsOverridden('timerFired')): return
+        if (app._frameStats is not None): app._frameStats.tick(time.perf_counter())
         if (not app._paused):
-            app.timerFired()
+            app._timedCall('timerFired', app.timerFired)
             app._redrawAllWrapper()
         app._deferredMethodCall(afterId='_timerFiredWrapper', afterDelay=app.timerDelay, afterFn=app._timerFiredWrapper)
 
@@ -547,8 +849,8 @@ class App(object):
             if ((app._lastMousePosn !=  (event.x, event.y)) and
                 (event.x >= 0) and (event.x <= app.width) and
                 (event.y >= 0) and (event.y <= app.height)):
-                if (app._mouseIsPressed): app.mouseDragged(event)
-                else: app.mouseMoved(event)
+                if (app._mouseIsPressed): app._timedCall('mouseDragged', app.mouseDragged, event)
+                else: app._timedCall('mouseMoved', app.mouseMoved, event)
                 app._lastMousePosn = (event.x, event.y)
                 app._redrawAllWrapper()
         if (mouseMovedExists or mouseDraggedExists):
@@ -613,6 +915,7 @@ class App(object):
         for afterId in app._afterIdMap: app._root.after_cancel(app._afterIdMap[afterId])
         app._afterIdMap.clear() # for safety
         app.appStopped()
+        if (app._drawCallLog is not None): app._drawCallLog.close()
         print(app.getQuitMessage())
 
 ####################################
@@ -679,6 +982,17 @@ class ModalApp(App):
         app._activeMode.modeActivated()  # called each time a mode is activated
         app._redrawAllWrapper()
 
+    def _getCallbackLabel(app, name):
+        # time callbacks per mode, as in 'GameMode.timerFired'
+        if (app._activeMode is None): return name
+        return f'{type(app._activeMode).__name__}.{name}'
+
+    def _getGeneration(app):
+        # the active mode is part of the model too
+        generation = app.__dict__.get('_generation', 0)
+        if (app._activeMode is None): return generation
+        return (generation, app._activeMode._getGeneration())
+
     def redrawAll(app, canvas):
         if (app._activeMode != None): app._activeMode.redrawAll(canvas)
     def appStarted(app):